@@ -0,0 +1,105 @@
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from email_marketing.columnar import ColumnBatch
+from email_marketing.email_marketing import EmailMarketing, Recipient
+
+
+# Per-row memory and construction time of the email_marketing record types:
+# the previous __dict__-based class, the slotted class, a plain row tuple, the
+# sender's Recipient named tuple, and a ColumnBatch of the same rows.
+#
+#   python -m benchmarks.models --rows 100000
+
+
+class DictEmailMarketing:
+    # EmailMarketing as it was before __slots__
+    def __init__(self, id, email, first_name, last_name, source_table, source_id, opt_in_status):
+        self.id = id
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.source_table = source_table
+        self.source_id = source_id
+        self.opt_in_status = opt_in_status
+        self.created_at = None
+        self.updated_at = None
+
+
+def make_values(count):
+    # Built up front so the measurements only count the containers
+    return [
+        (f"id-{i}", f"user{i}@example.com", "First", "Last", "account", str(i), True)
+        for i in range(count)
+    ]
+
+
+def build_dict_objects(values):
+    return [DictEmailMarketing(*value) for value in values]
+
+
+def build_slotted_objects(values):
+    return [EmailMarketing(*value) for value in values]
+
+
+def build_tuples(values):
+    return [value + (None, None) for value in values]
+
+
+def build_recipients(values):
+    return [Recipient(value[0], value[1], value[2]) for value in values]
+
+
+def build_column_batch(values):
+    return ColumnBatch(EmailMarketing.COLUMNS, (value + (None, None) for value in values))
+
+
+def measure(build, values):
+    # Timed without tracemalloc, which slows allocation down
+    gc.collect()
+    started = time.perf_counter()
+    result = build(values)
+    elapsed = time.perf_counter() - started
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = build(values)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "bytes_per_row": round(allocated / len(values), 1),
+        "ns_per_row": round(elapsed / len(values) * 1e9, 1),
+    }
+
+
+BUILDERS = [
+    ("dict class (before)", build_dict_objects),
+    ("slotted class", build_slotted_objects),
+    ("row tuple", build_tuples),
+    ("Recipient namedtuple", build_recipients),
+    ("ColumnBatch", build_column_batch),
+]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure per-row memory and construction time of record types.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    values = make_values(args.rows)
+    results = []
+    print(f"{'record type':<24}{'bytes/row':>12}{'ns/row':>10}")
+    for name, build in BUILDERS:
+        result = dict(name=name, **measure(build, values))
+        results.append(result)
+        print(f"{name:<24}{result['bytes_per_row']:>12}{result['ns_per_row']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,91 @@
+import argparse
+import json
+from collections import namedtuple
+
+from mail_trap.fake_server import FakeMailtrapOptions, server_url, start_fake_server
+from mail_trap.main import bulk_stream, transactional_stream
+from mail_trap.transport import HttpTransport
+
+
+# Drives transactional_stream and bulk_stream against the local fake Mailtrap
+# server and reports latency percentiles and throughput per concurrency level.
+#
+#   python -m benchmarks.send --recipients 2000 --latency 0.05 --concurrency 1 8 32
+
+Recipient = namedtuple("Recipient", ["id", "email", "first_name"])
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_recipients(count):
+    return [Recipient(str(i), f"user{i}@example.com", f"User{i}") for i in range(count)]
+
+
+def summarize(mode, level, report, latencies):
+    return {
+        "mode": mode,
+        "level": level,
+        "sent": report.sent,
+        "failed": report.failed,
+        "retries": report.retries,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "emails_per_second": round(report.emails_per_second, 1),
+    }
+
+
+def run(recipients, concurrency_levels, batch_sizes, options):
+    server = start_fake_server(options=options)
+    url = server_url(server)
+    rows = []
+    try:
+        for concurrency in concurrency_levels:
+            transport = HttpTransport(token="benchmark", base_url=url, pool_size=concurrency)
+            latencies = []
+            report = transactional_stream(
+                make_recipients(recipients), concurrency=concurrency, rate=None, transport=transport,
+                on_result=lambda item, result: latencies.append(result.latency))
+            rows.append(summarize("transactional", concurrency, report, latencies))
+            transport.close()
+
+        for batch_size in batch_sizes:
+            transport = HttpTransport(token="benchmark", base_url=url)
+            latencies = []
+            report = bulk_stream(make_recipients(recipients), batch_size=batch_size, transport=transport,
+                                 on_result=lambda item, result: latencies.append(result.latency))
+            rows.append(summarize("batch", batch_size, report, latencies))
+            transport.close()
+    finally:
+        server.shutdown()
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the Mailtrap senders against a local fake server.")
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    rows = run(args.recipients, args.concurrency, args.batch_size, FakeMailtrapOptions(
+        args.latency, args.jitter, args.error_rate, args.rate_limit_rate, seed=0))
+
+    print(f"{'mode':<14}{'level':>7}{'sent':>8}{'failed':>8}{'retries':>9}{'p50 ms':>10}{'p99 ms':>10}{'emails/s':>10}")
+    for row in rows:
+        print(f"{row['mode']:<14}{row['level']:>7}{row['sent']:>8}{row['failed']:>8}{row['retries']:>9}"
+              f"{row['p50_ms']:>10}{row['p99_ms']:>10}{row['emails_per_second']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,131 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from email_marketing.connection import get_database
+from email_marketing.email_marketing import DEFAULT_CHUNK_SIZE, as_repository, update_email_marketing
+from email_marketing.logging_config import configure_logging
+from email_marketing.sqlite_repository import SqliteRepository
+from email_marketing.synthetic import DEFAULT_DUPLICATE_RATIO, DEFAULT_SEED, clear_tables, load_synthetic_data
+
+
+# End-to-end timing of update_email_marketing on synthetic data, against the
+# Spanner emulator or a test instance configured as for the app, or against an
+# in-memory SQLite repository with --backend sqlite. For each size
+# the tables are emptied, loaded with that many source rows (split between
+# account and user_feedback) and synced from scratch, then synced again with
+# nothing new to find. Each size runs in its own process so the peak RSS is
+# that run's own.
+#
+#   python -m benchmarks.sync --sizes 10000 100000 1000000 --json sync.json
+#   python -m benchmarks.sync --backend sqlite --sizes 10000 100000 1000000
+#
+# The JSON output carries the parameters and commit it was measured at, so
+# results from different runs can be compared.
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed_sync(repository, **kwargs):
+    started = time.perf_counter()
+    result = update_email_marketing(repository, **kwargs)
+    elapsed = time.perf_counter() - started
+    scanned = sum(source["scanned"] for source in result["sources"].values())
+    added = sum(source["added"] for source in result["sources"].values())
+    return {
+        "seconds": round(elapsed, 3),
+        "scanned": scanned,
+        "added": added,
+        "rows_per_second": round(scanned / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": result["peak_rss_mb"],
+    }
+
+
+def run_size(size, backend, feedback_share, seed, duplicate_ratio, chunk_size, workers):
+    repository = SqliteRepository() if backend == "sqlite" else as_repository(get_database())
+    repository.create_tables()
+    clear_tables(repository)
+
+    user_feedback = int(size * feedback_share)
+    load = load_synthetic_data(repository, accounts=size - user_feedback, user_feedback=user_feedback, seed=seed,
+                               duplicate_ratio=duplicate_ratio)
+    first = timed_sync(repository, chunk_size=chunk_size, workers=workers)
+    repeat = timed_sync(repository, chunk_size=chunk_size, workers=workers)
+    return {
+        "size": size,
+        "distinct_emails": load["distinct_emails"],
+        "load_seconds": load["seconds"],
+        "sync": first,
+        "incremental_sync": repeat,
+    }
+
+
+def run(sizes, backend, feedback_share, seed, duplicate_ratio, chunk_size, workers):
+    results = []
+    for size in sizes:
+        command = [sys.executable, "-m", "benchmarks.sync", "--one", str(size), "--backend", backend,
+                   "--feedback-share", str(feedback_share), "--seed", str(seed),
+                   "--duplicate-ratio", str(duplicate_ratio), "--chunk-size", str(chunk_size)]
+        if workers:
+            command += ["--workers", str(workers)]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark update_email_marketing on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--backend", choices=["spanner", "sqlite"], default="spanner")
+    parser.add_argument("--feedback-share", type=float, default=0.5, help="share of rows in user_feedback")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--duplicate-ratio", type=float, default=DEFAULT_DUPLICATE_RATIO)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, help="partitioned read threads per source")
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.one is not None:
+        # Child process: one size, result as the last line of stdout
+        configure_logging("WARNING")
+        print(json.dumps(run_size(args.one, args.backend, args.feedback_share, args.seed, args.duplicate_ratio,
+                                  args.chunk_size, args.workers)))
+        sys.exit(0)
+
+    rows = run(args.sizes, args.backend, args.feedback_share, args.seed, args.duplicate_ratio, args.chunk_size,
+               args.workers)
+
+    print(f"{'rows':>10}{'distinct':>10}{'sync s':>10}{'rows/s':>12}{'peak MB':>10}{'rerun s':>10}")
+    for row in rows:
+        print(f"{row['size']:>10}{row['distinct_emails']:>10}{row['sync']['seconds']:>10}"
+              f"{row['sync']['rows_per_second']:>12}{row['sync']['peak_rss_mb']:>10}"
+              f"{row['incremental_sync']['seconds']:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "benchmark": "sync",
+                "commit": git_commit(),
+                "measured_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "params": {
+                    "backend": args.backend,
+                    "feedback_share": args.feedback_share,
+                    "seed": args.seed,
+                    "duplicate_ratio": args.duplicate_ratio,
+                    "chunk_size": args.chunk_size,
+                    "workers": args.workers,
+                },
+                "results": rows,
+            }, f, indent=2)
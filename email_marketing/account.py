@@ -1,7 +1,20 @@
+import logging
 from google.cloud import spanner
+from operator import attrgetter
+
+from .bulk_writer import write_rows
+from .pipeline import stream_rows
+
+logger = logging.getLogger(__name__)
 
 
 class Account:
+    __slots__ = ('id', 'email', 'auth_type', 'password', 'account_name', 'status', 'more_info',
+                 'created_at', 'updated_at', 'created_by', 'updated_by', 'version')
+
+    COLUMNS = ('id', 'email', 'auth_type', 'password', 'account_name', 'status', 'more_info',
+               'created_at', 'updated_at', 'created_by', 'updated_by', 'version')
+
     def __init__(self, id, email, auth_type, password, account_name, status, more_info, created_by, updated_by, version):
         self.id = id
         self.email = email
@@ -39,114 +52,55 @@ class Account:
             "version": self.version
         }
 
+    def to_row(self):
+        return _account_row(self)
 
-def create_table(database):
-    # Check if the table already exists
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql(
-            "SELECT table_name FROM information_schema.tables WHERE table_name = 'account'"
-        )
-        table_exists = any(row for row in results)
-
-    if table_exists:
-        print("Account table already exists. Skipping creation.")
-        return
-
-    # DDL statement to create the table
-    ddl_statements = [
-        """
-        CREATE TABLE account (
-            id STRING(MAX) NOT NULL,
-            email STRING(MAX) NOT NULL,
-            auth_type STRING(MAX) NOT NULL,
-            password STRING(MAX) NOT NULL,
-            account_name STRING(MAX),
-            status STRING(MAX) NOT NULL,
-            more_info JSON NOT NULL,
-            created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
-            updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
-            created_by STRING(MAX) NOT NULL,
-            updated_by STRING(MAX) NOT NULL,
-            version INT64 NOT NULL
-        ) PRIMARY KEY (id)
-        """
-    ]
 
-    # Apply the DDL statement to create the table
-    operation = database.update_ddl(ddl_statements)
-    print("Waiting for operation to complete...")
-    operation.result()
-    print("Account table created successfully.")
+_account_row = attrgetter(*Account.COLUMNS)
 
 
 def insert_single_entry(database, account: Account):
     with database.batch() as batch:
         batch.insert(
             table='account',
-            columns=(
-                'id', 'email', 'auth_type', 'password', 'account_name', 'status',
-                'more_info', 'created_at', 'updated_at', 'created_by', 'updated_by', 'version'
-            ),
-            values=[
-                (
-                    account.id, account.email, account.auth_type, account.password, account.account_name, account.status,
-                    account.more_info, account.created_at, account.updated_at,
-                    account.created_by, account.updated_by, account.version
-                ),
-            ]
+            columns=Account.COLUMNS,
+            values=[account.to_row()]
         )
-    print("Single entry inserted successfully.")
+    logger.info("Single entry inserted successfully.")
+
+
+def insert_bulk_entries(database, accounts, mode='insert'):
+    stats = write_rows(database, 'account', Account.COLUMNS, (account.to_row() for account in accounts), mode=mode)
+    logger.info("Bulk entries inserted successfully: %s", stats)
+    return stats
+
+
+def read_all_entries(database, workers=None):
+    accounts = []
+    for row in stream_rows(database, "SELECT * FROM account", workers=workers):
+        account = Account(
+            id=row[0],
+            email=row[1],
+            auth_type=row[2],
+            password=row[3],
+            account_name=row[4],
+            status=row[5],
+            more_info=row[6],
+            created_by=row[9],
+            updated_by=row[10],
+            version=row[11]
+        )
+        account.created_at = row[7]
+        account.updated_at = row[8]
+        accounts.append(account)
 
+    return accounts
 
-def insert_bulk_entries(database, accounts):
-    with database.batch() as batch:
-        batch.insert(
-            table='account',
-            columns=(
-                'id', 'email', 'auth_type', 'password', 'account_name', 'status',
-                'more_info', 'created_at', 'updated_at', 'created_by', 'updated_by', 'version'
-            ),
-            values=[
-                (
-                    account.id, account.email, account.auth_type, account.password, account.account_name, account.status,
-                    account.more_info, account.created_at, account.updated_at,
-                    account.created_by, account.updated_by, account.version
-                )
-                for account in accounts
-            ]
-        )
-    print("Bulk entries inserted successfully.")
-
-
-def read_all_entries(database):
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql("SELECT * FROM account")
-        accounts = []
-        for row in results:
-            account = Account(
-                id=row[0],
-                email=row[1],
-                auth_type=row[2],
-                password=row[3],
-                account_name=row[4],
-                status=row[5],
-                more_info=row[6],
-                created_by=row[9],
-                updated_by=row[10],
-                version=row[11]
-            )
-            account.created_at = row[7]
-            account.updated_at = row[8]
-            accounts.append(account)
-            print(account)
-
-        return accounts
 
 # Function to populate the database with test entries
 
 
 def populate_test_entries(database):
-    create_table(database)
     bulk_accounts = [
         Account(
             '1', 'example@example.com', 'password', 'example_password', 'Example Name', 'active',
@@ -163,5 +117,6 @@ def populate_test_entries(database):
         # Add more entries as needed
     ]
 
-    insert_bulk_entries(database, bulk_accounts)
-    print("Database populated with test entries successfully.")
+    # Upserted, so populating twice is harmless
+    insert_bulk_entries(database, bulk_accounts, mode='insert_or_update')
+    logger.info("Database populated with test entries successfully.")
@@ -0,0 +1,156 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from google.api_core.exceptions import Aborted, ServiceUnavailable
+
+from .metrics import COMMIT_RETRIES, COMMIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+# Shared writer for the bulk paths. Rows are split into commits that stay under
+# Spanner's per-commit mutation limit (each row counts one mutation per column,
+# plus one per secondary index entry) and a byte budget, and the commits run in
+# parallel on a thread pool. Aborted and ServiceUnavailable commits are retried
+# with backoff. A retried insert whose first attempt did land fails with
+# AlreadyExists; insert_or_update makes reruns and retries idempotent.
+#
+#   stats = write_rows(database, 'account', Account.COLUMNS, rows, mode='insert_or_update')
+
+MAX_COMMIT_MUTATIONS = 80000
+# Below the 100 MB commit limit; string sizes are counted in characters
+MAX_COMMIT_BYTES = 64 * 1024 * 1024
+DEFAULT_WRITE_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 10
+
+MODES = ('insert', 'insert_or_update', 'update', 'replace')
+RETRYABLE_ERRORS = (Aborted, ServiceUnavailable)
+
+
+def value_bytes(value):
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+
+def split_commits(rows, max_rows, max_bytes):
+    commit = []
+    size = 0
+    for row in rows:
+        row_size = sum(value_bytes(value) for value in row)
+        if commit and (len(commit) >= max_rows or size + row_size > max_bytes):
+            yield commit
+            commit = []
+            size = 0
+        commit.append(row)
+        size += row_size
+    if commit:
+        yield commit
+
+
+class BulkWriteStats:
+    def __init__(self):
+        self.rows = 0
+        self.commits = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def committed(self, rows, retries):
+        with self.lock:
+            self.rows += rows
+            self.commits += 1
+            self.retries += retries
+
+    def summary(self):
+        return {
+            "rows": self.rows,
+            "commits": self.commits,
+            "retries": self.retries,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows / self.seconds, 1) if self.seconds > 0 else 0.0,
+            "commits_per_second": round(self.commits / self.seconds, 2) if self.seconds > 0 else 0.0
+        }
+
+
+class BulkWriter:
+    def __init__(self, database, table, columns, mode='insert', workers=DEFAULT_WRITE_WORKERS,
+                 max_mutations=MAX_COMMIT_MUTATIONS, max_bytes=MAX_COMMIT_BYTES, mutations_per_row=None,
+                 max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+        if mode not in MODES:
+            raise ValueError(f"Unknown write mode {mode!r}, expected one of {', '.join(MODES)}")
+        self.database = database
+        self.table = table
+        self.columns = tuple(columns)
+        self.mode = mode
+        self.workers = workers
+        self.max_rows = max(1, max_mutations // (mutations_per_row or len(self.columns)))
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.stats = BulkWriteStats()
+
+    def commit(self, rows):
+        attempt = 0
+        while True:
+            try:
+                with COMMIT_SECONDS.labels(table=self.table).time():
+                    with self.database.batch() as batch:
+                        getattr(batch, self.mode)(table=self.table, columns=self.columns, values=rows)
+                break
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                COMMIT_RETRIES.labels(table=self.table).inc()
+                delay = min(MAX_RETRY_DELAY, self.retry_delay * (2 ** (attempt - 1))) * random.uniform(0.5, 1.5)
+                logger.warning("Commit of %d rows to %s failed (%s), retrying in %.2fs.",
+                               len(rows), self.table, type(e).__name__, delay)
+                time.sleep(delay)
+        self.stats.committed(len(rows), attempt)
+        return len(rows)
+
+    # Writes every row before returning; the first failed commit is raised once
+    # the commits already in flight have finished
+    def write(self, rows):
+        started = time.monotonic()
+        commits = split_commits(rows, self.max_rows, self.max_bytes)
+        first = next(commits, None)
+        second = next(commits, None)
+        written = 0
+        try:
+            if first is None:
+                return 0
+            if second is None or self.workers <= 1:
+                # Small writes skip the thread pool
+                for commit in ([first, second] if second is not None else [first]):
+                    written += self.commit(commit)
+                for commit in commits:
+                    written += self.commit(commit)
+                return written
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                in_flight = {executor.submit(self.commit, first), executor.submit(self.commit, second)}
+                try:
+                    for commit in commits:
+                        if len(in_flight) >= self.workers * 2:
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            written += sum(future.result() for future in done)
+                        in_flight.add(executor.submit(self.commit, commit))
+                finally:
+                    done, _ = wait(in_flight)
+                written += sum(future.result() for future in done)
+            return written
+        finally:
+            self.stats.seconds += time.monotonic() - started
+
+
+def write_rows(database, table, columns, rows, mode='insert', **kwargs):
+    writer = BulkWriter(database, table, columns, mode=mode, **kwargs)
+    writer.write(rows)
+    return writer.stats.summary()
@@ -0,0 +1,39 @@
+# Column-oriented container for a chunk of rows on the bulk paths. Values are
+# kept in one list per column instead of one object or tuple per row; rows()
+# yields the tuples batch.insert(values=...) expects, lazily, at commit time.
+
+
+class ColumnBatch:
+    __slots__ = ('columns', 'data')
+
+    def __init__(self, columns, rows=()):
+        self.columns = tuple(columns)
+        self.data = tuple([] for _ in self.columns)
+        self.extend(rows)
+
+    def append(self, row):
+        for values, value in zip(self.data, row):
+            values.append(value)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self.data[0]) if self.data else 0
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def column(self, name):
+        return self.data[self.columns.index(name)]
+
+    def rows(self):
+        return zip(*self.data)
+
+    def __iter__(self):
+        return self.rows()
+
+    def clear(self):
+        for values in self.data:
+            values.clear()
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from google.cloud import spanner
+
+logger = logging.getLogger(__name__)
+
+# Loads SPANNER_EMULATOR_HOST, GOOGLE_CLOUD_PROJECT and SPANNER_EMULATOR_CREDENTIALS
+# for the local emulator; real deployments set them in the environment instead.
+load_dotenv()
+
+# Shared Spanner connection for both entry points. Nothing is created at import
+# time: the client, instance and session pool are built on the first call to
+# get_database(), or ahead of time in the background by warm_up().
+
+INSTANCE_ID = os.getenv("SPANNER_INSTANCE_ID", "test-instance")
+DATABASE_ID = os.getenv("SPANNER_DATABASE_ID", "test-database")
+
+POOL_TYPE = os.getenv("SPANNER_POOL_TYPE", "fixed")  # fixed, bursty or pinging
+POOL_SIZE = int(os.getenv("SPANNER_POOL_SIZE", 10))
+POOL_TIMEOUT = int(os.getenv("SPANNER_POOL_TIMEOUT", 10))
+PING_INTERVAL = int(os.getenv("SPANNER_PING_INTERVAL", 300))
+
+_database = None
+_lock = threading.Lock()
+
+
+def create_pool(pool_type=POOL_TYPE, size=POOL_SIZE):
+    if pool_type == "fixed":
+        # Creates every session up front when bound to the database
+        return spanner.FixedSizePool(size=size, default_timeout=POOL_TIMEOUT)
+    if pool_type == "bursty":
+        # Creates sessions on demand and keeps up to size of them
+        return spanner.BurstyPool(target_size=size)
+    if pool_type == "pinging":
+        # Like fixed, but idle sessions are kept alive by ping()
+        return spanner.PingingPool(size=size, default_timeout=POOL_TIMEOUT, ping_interval=PING_INTERVAL)
+    raise ValueError(f"Unknown SPANNER_POOL_TYPE {pool_type!r}, expected fixed, bursty or pinging")
+
+
+def get_database():
+    global _database
+    if _database is None:
+        with _lock:
+            if _database is None:
+                started = time.monotonic()
+                pool = create_pool()
+                client = spanner.Client()
+                instance = client.instance(INSTANCE_ID)
+                _database = instance.database(DATABASE_ID, pool=pool)
+                if isinstance(pool, spanner.PingingPool):
+                    _start_pinging(pool)
+                logger.info("Spanner %s pool of %d sessions ready in %.2fs.",
+                            POOL_TYPE, POOL_SIZE, time.monotonic() - started)
+    return _database
+
+
+def _start_pinging(pool):
+    def ping_forever():
+        while True:
+            pool.ping()
+            time.sleep(PING_INTERVAL / 10)
+
+    threading.Thread(target=ping_forever, name="spanner-pool-ping", daemon=True).start()
+
+
+def warm_up(background=True):
+    # Builds the client and pool off the request path
+    if not background:
+        return get_database()
+    thread = threading.Thread(target=get_database, name="spanner-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -1,8 +1,33 @@
+import logging
+from abc import ABC, abstractmethod
 from google.cloud import spanner
 import uuid
+from collections import namedtuple
+from datetime import timedelta
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor
+
+from .account import insert_bulk_entries as insert_account_entries
+from .bulk_writer import write_rows
+from .columnar import ColumnBatch
+from .fingerprint_index import fingerprint, open_index
+from .metrics import (SYNC_DUPLICATES_SKIPPED, SYNC_FAILURES, SYNC_ROWS_SCANNED,
+                      SYNC_ROWS_WRITTEN, SYNC_STAGE_SECONDS)
+from .migrations import ACCOUNT_UPDATED_AT_INDEX, EMAIL_INDEX, USER_FEEDBACK_CREATION_INDEX, extra_mutations, migrate
+from .pipeline import ChunkWriter, chunked, peak_rss_mb, stream_query, stream_rows
+from .sync_state import get_watermarks, set_watermarks
+from .user_feedback import insert_bulk_entries as insert_user_feedback_entries
+
+logger = logging.getLogger(__name__)
 
 
 class EmailMarketing:
+    __slots__ = ('id', 'email', 'first_name', 'last_name', 'source_table', 'source_id', 'opt_in_status',
+                 'created_at', 'updated_at')
+
+    COLUMNS = ('id', 'email', 'first_name', 'last_name', 'source_table', 'source_id', 'opt_in_status',
+               'created_at', 'updated_at')
+
     def __init__(self, id, email, first_name, last_name, source_table, source_id, opt_in_status):
         self.id = id
         self.email = email
@@ -32,6 +57,9 @@ class EmailMarketing:
             "updated_at": self.updated_at
         }
 
+    def to_row(self):
+        return _email_marketing_row(self)
+
     def get_email(self):
         return self.email
 
@@ -42,43 +70,11 @@ class EmailMarketing:
         return self.last_name
 
 
-# Method to create the table
+_email_marketing_row = attrgetter(*EmailMarketing.COLUMNS)
 
-
-def create_table(database):
-    # Check if the table already exists
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql(
-            "SELECT table_name FROM information_schema.tables WHERE table_name = 'email_marketing'"
-        )
-        table_exists = any(row for row in results)
-
-    if table_exists:
-        print("EmailMarketing table already exists. Skipping creation.")
-        return
-
-    # DDL statement to create the table
-    ddl_statements = [
-        """
-        CREATE TABLE email_marketing (
-            id STRING(50) NOT NULL,
-            email STRING(1024) NOT NULL,
-            first_name STRING(256),
-            last_name STRING(256),
-            source_table STRING(50) NOT NULL,
-            source_id STRING(50) NOT NULL,
-            opt_in_status BOOL NOT NULL,
-            created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
-            updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
-        ) PRIMARY KEY (id)
-        """
-    ]
-
-    # Apply the DDL statement to create the table
-    operation = database.update_ddl(ddl_statements)
-    print("Waiting for operation to complete...")
-    operation.result()
-    print("EmailMarketing table created successfully.")
+# Mutations an email_marketing row writes beyond its columns: the generated
+# email_normalized and the key and STORING columns of each secondary index
+EMAIL_MARKETING_EXTRA_MUTATIONS = extra_mutations('email_marketing')
 
 # Method to insert a single entry
 
@@ -87,69 +83,111 @@ def insert_single_entry(database, email_marketing: EmailMarketing):
     with database.batch() as batch:
         batch.insert(
             table='email_marketing',
-            columns=(
-                'id', 'email', 'first_name', 'last_name', 'source_table', 'source_id', 'opt_in_status',
-                'created_at', 'updated_at'
-            ),
-            values=[
-                (
-                    email_marketing.id, email_marketing.email, email_marketing.first_name, email_marketing.last_name,
-                    email_marketing.source_table, email_marketing.source_id, email_marketing.opt_in_status,
-                    email_marketing.created_at, email_marketing.updated_at
-                ),
-            ]
+            columns=EmailMarketing.COLUMNS,
+            values=[email_marketing.to_row()]
         )
-    print("Single entry inserted successfully.")
+    logger.info("Single entry inserted successfully.")
 
 # Method to insert bulk entries
 
 
 def insert_bulk_entries(database, email_marketing_list):
-    with database.batch() as batch:
-        batch.insert(
-            table='email_marketing',
-            columns=(
-                'id', 'email', 'first_name', 'last_name', 'source_table', 'source_id', 'opt_in_status',
-                'created_at', 'updated_at'
-            ),
-            values=[
-                (
-                    generate_unique_id(), email_marketing.email, email_marketing.first_name, email_marketing.last_name,
-                    email_marketing.source_table, email_marketing.source_id, email_marketing.opt_in_status,
-                    email_marketing.created_at, email_marketing.updated_at
-                )
-                for email_marketing in email_marketing_list
-            ]
-        )
-    print("Bulk entries inserted successfully.")
+    return insert_rows(database, (
+        (generate_unique_id(),) + email_marketing.to_row()[1:]
+        for email_marketing in email_marketing_list
+    ))
+
+# Method to insert rows already laid out in EmailMarketing.COLUMNS order, such as a ColumnBatch
+
+
+def insert_rows(database, rows):
+    # Every row has a fresh id, so insert_or_update never overwrites an entry: a
+    # duplicate email still fails on the unique index, and a retried commit
+    # whose first attempt landed does not fail with AlreadyExists
+    stats = write_rows(database, 'email_marketing', EmailMarketing.COLUMNS, rows, mode='insert_or_update',
+                       mutations_per_row=len(EmailMarketing.COLUMNS) + EMAIL_MARKETING_EXTRA_MUTATIONS)
+    logger.debug("Bulk entries inserted successfully: %s", stats)
+    return stats
 
 # Method to read all entries
 
 
-def get_all_entries(database):
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql("SELECT * FROM email_marketing")
-        email_marketing_list = []
-        for row in results:
-            email_marketing = EmailMarketing(
-                id=row[0],
-                email=row[1],
-                first_name=row[2],
-                last_name=row[3],
-                source_table=row[4],
-                source_id=row[5],
-                opt_in_status=row[6]
-            )
-            email_marketing.created_at = row[7]
-            email_marketing.updated_at = row[8]
-            email_marketing_list.append(email_marketing)
+def get_all_entries(database, workers=None):
+    email_marketing_list = []
+    for row in stream_rows(database, "SELECT * FROM email_marketing", workers=workers):
+        email_marketing = EmailMarketing(
+            id=row[0],
+            email=row[1],
+            first_name=row[2],
+            last_name=row[3],
+            source_table=row[4],
+            source_id=row[5],
+            opt_in_status=row[6]
+        )
+        email_marketing.created_at = row[7]
+        email_marketing.updated_at = row[8]
+        email_marketing_list.append(email_marketing)
+
+    return email_marketing_list
 
-        return email_marketing_list
 
+# Projection of email_marketing needed by the senders
+Recipient = namedtuple('Recipient', ['id', 'email', 'first_name'])
 
-def read_all_entries(database):
-    entries = get_all_entries(database)
-    print(entries)
+DEFAULT_PAGE_SIZE = 1000
+
+
+def recipient_page_query(last_id, page_size, opted_in_only=True, source_table=None, created_after=None):
+    conditions = []
+    params = {"page_size": page_size}
+    param_types = {"page_size": spanner.param_types.INT64}
+    if last_id is not None:
+        conditions.append("id > @last_id")
+        params["last_id"] = last_id
+        param_types["last_id"] = spanner.param_types.STRING
+    if opted_in_only:
+        conditions.append("opt_in_status = TRUE")
+    if source_table is not None:
+        conditions.append("source_table = @source_table")
+        params["source_table"] = source_table
+        param_types["source_table"] = spanner.param_types.STRING
+    if created_after is not None:
+        conditions.append("created_at > @created_after")
+        params["created_after"] = created_after
+        param_types["created_after"] = spanner.param_types.TIMESTAMP
+
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    sql = f"SELECT id, email, first_name FROM email_marketing {where}ORDER BY id LIMIT @page_size"
+    return sql, params, param_types
+
+
+# Streams recipients in primary key order, one keyset page at a time. The next
+# page is fetched in the background while the current one is consumed, so
+# sending starts after the first page and memory stays at about two pages.
+
+
+def iter_recipients(database, page_size=DEFAULT_PAGE_SIZE, opted_in_only=True, source_table=None,
+                    created_after=None):
+    repository = as_repository(database)
+
+    def fetch_page(last_id):
+        return repository.recipient_page(last_id, page_size, opted_in_only, source_table, created_after)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_page = executor.submit(fetch_page, None)
+        while next_page is not None:
+            page = next_page.result()
+            next_page = None
+            if len(page) == page_size:
+                next_page = executor.submit(fetch_page, page[-1].id)
+            yield from page
+
+
+def read_all_entries(database, workers=None):
+    entries = get_all_entries(database, workers)
+    logger.info("%d email_marketing entries.", len(entries))
+    for entry in entries:
+        logger.debug("%r", entry)
 
 
 def update_opt_in_status(database, id, new_status):
@@ -159,7 +197,7 @@ def update_opt_in_status(database, id, new_status):
             columns=('id', 'opt_in_status', 'updated_at'),
             values=[(id, new_status, spanner.COMMIT_TIMESTAMP)]
         )
-    print(f"Opt-in status for entry with ID {id} updated successfully.")
+    logger.info("Opt-in status for entry with ID %s updated successfully.", id)
 
 
 def truncate_table(database):
@@ -168,65 +206,443 @@ def truncate_table(database):
             table='email_marketing',
             keyset=spanner.KeySet(all_=True)
         )
-    print("EmailMarketing table emptied successfully.")
+    logger.info("EmailMarketing table emptied successfully.")
 
 
 def generate_unique_id():
     return str(uuid.uuid4())
 
 
-def update_email_marketing(database):
+# Each source is read with its change-tracking timestamp so the sync can resume
+# from the last high-water mark instead of rescanning the whole table: the
+# (select, timestamp column, index on it) of each source. The scan goes through
+# the timestamp index, which stores the selected columns, and the anti-join
+# against the email index keeps known emails on the server.
+SOURCE_QUERIES = {
+    'user_feedback': (
+        "SELECT src.id, src.email, src.username, src.creation_time",
+        "creation_time",
+        USER_FEEDBACK_CREATION_INDEX
+    ),
+    'account': (
+        # updated_at is stamped on insert as well, so it covers new and changed rows
+        "SELECT src.id, src.email, src.account_name, src.updated_at",
+        "updated_at",
+        ACCOUNT_UPDATED_AT_INDEX
+    ),
+}
+
+UNSEEN_EMAIL_FILTER = (
+    "NOT EXISTS (SELECT 1 FROM email_marketing@{FORCE_INDEX=" + EMAIL_INDEX + "} AS em "
+    "WHERE em.email_normalized = LOWER(TRIM(src.email)))"
+)
+
+# user_feedback.creation_time is set by the application, so a row committed
+# after a sync can carry a time before that sync's watermark. Those sources are
+# re-read this far back from their watermark; the rows already synced are
+# dropped by the dedup. Rows committed later than this after their creation
+# time are still missed until a full sync. account.updated_at is a commit
+# timestamp and needs no window.
+DEFAULT_WATERMARK_LOOKBACK = timedelta(minutes=15)
+APP_TIMESTAMP_SOURCES = {'user_feedback'}
+
+EXISTING_EMAILS_BATCH_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def new_row_from_source(source_id, email, name, source_table):
+    # Row in EmailMarketing.COLUMNS order
+    return (
+        generate_unique_id(),
+        email,
+        name.split()[0] if name else None,
+        name.split()[-1] if name else None,
+        source_table,
+        source_id,
+        True,  # Assuming opt-in status is true for this example
+        spanner.COMMIT_TIMESTAMP,
+        spanner.COMMIT_TIMESTAMP
+    )
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+# Hash shard of the normalized email, in [0, @num_shards)
+SHARD_FILTER = "MOD(MOD(FARM_FINGERPRINT(LOWER(TRIM(src.email))), @num_shards) + @num_shards, @num_shards) = @shard_id"
+
+
+def source_filters(source_table, watermark=None, shard=None):
+    _, timestamp_column, _ = SOURCE_QUERIES[source_table]
+    conditions = ["src.email IS NOT NULL"]
+    params = {}
+    param_types = {}
+    if shard is not None:
+        conditions.append(SHARD_FILTER)
+        params["shard_id"], params["num_shards"] = shard
+        param_types["shard_id"] = param_types["num_shards"] = spanner.param_types.INT64
+    if watermark is not None:
+        conditions.append(f"src.{timestamp_column} > @watermark")
+        params["watermark"] = watermark
+        param_types["watermark"] = spanner.param_types.TIMESTAMP
+    return conditions, params, param_types
+
+
+def source_query(source_table, watermark=None, unseen_only=True, shard=None):
+    select, _, index = SOURCE_QUERIES[source_table]
+    conditions, params, param_types = source_filters(source_table, watermark, shard)
+    if unseen_only:
+        conditions.append(UNSEEN_EMAIL_FILTER)
+    return (f"{select} FROM {source_table}@{{FORCE_INDEX={index}}} AS src WHERE {' AND '.join(conditions)}",
+            params, param_types)
+
+
+def source_watermark_query(source_table, watermark=None, shard=None):
+    # Latest timestamp of the scanned range before the anti-join, so rows of
+    # emails that are already known still move the watermark past them
+    _, timestamp_column, index = SOURCE_QUERIES[source_table]
+    conditions, params, param_types = source_filters(source_table, watermark, shard)
+    return (f"SELECT MAX(src.{timestamp_column}) FROM {source_table}@{{FORCE_INDEX={index}}} AS src "
+            f"WHERE {' AND '.join(conditions)}", params, param_types)
+
+
+def stream_source_rows(database, source_table, watermark=None, unseen_only=True, workers=None, shard=None,
+                       on_watermark=None):
+    sql, params, param_types = source_query(source_table, watermark, unseen_only, shard)
+    before = None
+    if on_watermark is not None:
+        max_sql, max_params, max_param_types = source_watermark_query(source_table, watermark, shard)
+
+        def before(snapshot):
+            results = snapshot.execute_sql(max_sql, params=max_params or None, param_types=max_param_types or None)
+            on_watermark(list(results)[0][0])
+
+    return stream_rows(database, sql, params or None, param_types or None, workers, before)
+
+
+def get_existing_emails(database, normalized_emails):
     existing_emails = set()
+    normalized_emails = list(normalized_emails)
+    with database.snapshot(multi_use=True) as snapshot:
+        for start in range(0, len(normalized_emails), EXISTING_EMAILS_BATCH_SIZE):
+            results = snapshot.execute_sql(
+                "SELECT email_normalized FROM email_marketing@{FORCE_INDEX=" + EMAIL_INDEX + "} "
+                "WHERE email_normalized IN UNNEST(@emails)",
+                params={"emails": normalized_emails[start:start + EXISTING_EMAILS_BATCH_SIZE]},
+                param_types={"emails": spanner.param_types.Array(
+                    spanner.param_types.STRING)}
+            )
+            for row in results:
+                existing_emails.add(row[0])
+    return existing_emails
+
+
+# Storage used by the sync, the sender and the data loaders, so they can run
+# against Spanner or a local database. Source rows are (id, email, name,
+# timestamp) and email_marketing rows are in EmailMarketing.COLUMNS order.
+class Repository(ABC):
+    @abstractmethod
+    def create_tables(self):
+        pass
+
+    @abstractmethod
+    def clear_tables(self, tables):
+        pass
+
+    # on_watermark, if given, is called once with the latest timestamp of the
+    # scanned range, from the snapshot the rows are read in
+    @abstractmethod
+    def scan_source(self, source_table, watermark=None, unseen_only=True, workers=None, shard=None,
+                    on_watermark=None):
+        pass
+
+    @abstractmethod
+    def existing_emails(self, normalized_emails):
+        pass
+
+    @abstractmethod
+    def normalized_emails(self):
+        pass
+
+    @abstractmethod
+    def insert_email_marketing(self, rows):
+        pass
+
+    @abstractmethod
+    def recipient_page(self, last_id, page_size, opted_in_only=True, source_table=None, created_after=None):
+        pass
+
+    @abstractmethod
+    def get_watermarks(self):
+        pass
+
+    @abstractmethod
+    def set_watermarks(self, watermarks):
+        pass
+
+    @abstractmethod
+    def insert_accounts(self, accounts):
+        pass
+
+    @abstractmethod
+    def insert_user_feedback(self, feedback_list):
+        pass
+
+
+class SpannerRepository(Repository):
+    def __init__(self, database):
+        self.database = database
+
+    def create_tables(self):
+        migrate(self.database)
+
+    def clear_tables(self, tables):
+        with self.database.snapshot() as snapshot:
+            results = snapshot.execute_sql(
+                "SELECT table_name FROM information_schema.tables WHERE table_name IN UNNEST(@tables)",
+                params={"tables": list(tables)},
+                param_types={"tables": spanner.param_types.Array(spanner.param_types.STRING)}
+            )
+            existing = {row[0] for row in results}
 
-    # Fetch existing emails from email_marketing table
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql("SELECT email FROM email_marketing")
-        for row in results:
-            existing_emails.add(row[0])
-
-    new_entries = []
-
-    # Traverse user_feedback table
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql(
-            "SELECT id, email, username, full_name FROM user_feedback WHERE email IS NOT NULL")
-        for row in results:
-            if row[1] not in existing_emails:
-                new_entry = EmailMarketing(
-                    id=row[0],
-                    email=row[1],
-                    first_name=row[2].split()[0] if row[2] else None,
-                    last_name=row[2].split()[-1] if row[2] else None,
-                    source_table='user_feedback',
-                    source_id=row[0],
-                    opt_in_status=True  # Assuming opt-in status is true for this example
-                )
-                new_entries.append(new_entry)
-                existing_emails.add(row[1])
-
-    # Traverse account table
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql(
-            "SELECT id, email, account_name FROM account WHERE email IS NOT NULL")
-        for row in results:
-            if row[1] not in existing_emails:
-                new_entry = EmailMarketing(
-                    id=row[0],
-                    email=row[1],
-                    first_name=row[2].split()[0] if row[2] else None,
-                    last_name=row[2].split()[-1] if row[2] else None,
-                    source_table='account',
-                    source_id=row[0],
-                    opt_in_status=True  # Assuming opt-in status is true for this example
-                )
-                new_entries.append(new_entry)
-                existing_emails.add(row[1])
-
-    # Insert new entries into email_marketing table
-    if new_entries:
-        insert_bulk_entries(database, new_entries)
-        print(f"{len(new_entries)} new entries added to email_marketing table.")
-    else:
-        print("No new entries to add.")
+        # Partitioned DML removes millions of rows without one huge transaction
+        for table in tables:
+            if table in existing:
+                self.database.execute_partitioned_dml(f"DELETE FROM {table} WHERE TRUE")
+                logger.info("%s emptied.", table)
 
-    return "Test Success"
+    def scan_source(self, source_table, watermark=None, unseen_only=True, workers=None, shard=None,
+                    on_watermark=None):
+        return stream_source_rows(self.database, source_table, watermark, unseen_only, workers, shard, on_watermark)
+
+    def existing_emails(self, normalized_emails):
+        return get_existing_emails(self.database, normalized_emails)
+
+    def normalized_emails(self):
+        return (row[0] for row in stream_query(self.database, "SELECT email_normalized FROM email_marketing"))
+
+    def insert_email_marketing(self, rows):
+        insert_rows(self.database, rows)
+
+    def recipient_page(self, last_id, page_size, opted_in_only=True, source_table=None, created_after=None):
+        sql, params, param_types = recipient_page_query(
+            last_id, page_size, opted_in_only, source_table, created_after)
+        with self.database.snapshot() as snapshot:
+            results = snapshot.execute_sql(sql, params=params, param_types=param_types)
+            return [Recipient(*row) for row in results]
+
+    def get_watermarks(self):
+        return get_watermarks(self.database)
+
+    def set_watermarks(self, watermarks):
+        set_watermarks(self.database, watermarks)
+
+    def insert_accounts(self, accounts):
+        insert_account_entries(self.database, accounts)
+
+    def insert_user_feedback(self, feedback_list):
+        insert_user_feedback_entries(self.database, feedback_list)
+
+
+def as_repository(database):
+    if isinstance(database, Repository):
+        return database
+    return SpannerRepository(database)
+
+
+# Default dedup: known emails are dropped by the source query's anti-join and
+# each chunk is re-checked against the email index.
+class QueryDedup:
+    unseen_only = True
+
+    def existing_emails(self, repository, normalized_emails):
+        return repository.existing_emails(normalized_emails)
+
+    def insert(self, repository, rows):
+        repository.insert_email_marketing(rows)
+        return rows
+
+    def added(self, normalized_emails):
+        pass
+
+    def close(self):
+        pass
+
+
+# Dedup against a local fingerprint file: only fingerprint hits (which may be
+# hash collisions) are confirmed against Spanner. Emails written by other paths
+# (/events ingestion, imports) are not in the file, so a chunk that fails is
+# re-checked against the email index: the emails found there are added to the
+# file and the rest of the chunk is written again.
+class FingerprintDedup:
+    unseen_only = False
+
+    def __init__(self, index):
+        self.index = index
+
+    def existing_emails(self, repository, normalized_emails):
+        hits = [email for email in normalized_emails if fingerprint(email) in self.index]
+        return repository.existing_emails(hits) if hits else set()
+
+    def insert(self, repository, rows):
+        try:
+            repository.insert_email_marketing(rows)
+            return rows
+        except Exception:
+            email_position = EmailMarketing.COLUMNS.index('email')
+            existing = repository.existing_emails({normalize_email(email) for email in rows.column('email')})
+            if not existing:
+                raise
+        logger.warning("%d emails written outside the sync were missing from the fingerprint index; adding them.",
+                       len(existing))
+        self.added(existing)
+        rows = ColumnBatch(EmailMarketing.COLUMNS, (
+            row for row in rows if normalize_email(row[email_position]) not in existing))
+        if rows:
+            repository.insert_email_marketing(rows)
+        return rows
+
+    def added(self, normalized_emails):
+        self.index.add(fingerprint(email) for email in normalized_emails)
+
+    def close(self):
+        self.index.compact()
+        self.index.close()
+
+
+def dedup_source_rows(repository, rows, source_table, writer, stats, chunk_size, dedup, on_progress=None):
+    # Emails added earlier in this run are either committed since (caught by the
+    # per-chunk lookup) or still pending in the writer. The writer can flush in
+    # the middle of a chunk and empty pending_keys, so the keys pending at
+    # lookup time are taken into existing_emails instead of checked row by row.
+    for chunk in chunked(rows, chunk_size):
+        with SYNC_STAGE_SECONDS.labels(stage='lookup').time():
+            existing_emails = dedup.existing_emails(
+                repository, {normalize_email(row[1]) for row in chunk})
+        existing_emails |= writer.pending_keys
+        seen_in_chunk = set()
+        duplicates = 0
+        for row in chunk:
+            email = normalize_email(row[1])
+            if email in existing_emails or email in seen_in_chunk:
+                duplicates += 1
+                continue
+
+            seen_in_chunk.add(email)
+            stats["added"] += 1
+            yield email, new_row_from_source(row[0], row[1], row[2], source_table)
+
+        stats["scanned"] += len(chunk)
+        stats["duplicates"] += duplicates
+        SYNC_ROWS_SCANNED.labels(source=source_table).inc(len(chunk))
+        SYNC_DUPLICATES_SKIPPED.labels(source=source_table).inc(duplicates)
+        if on_progress is not None:
+            on_progress(source_table, stats)
+
+
+def watermark_key(source_table, shard=None):
+    if shard is None:
+        return source_table
+    return f"{source_table}#{shard[0]}/{shard[1]}"
+
+
+# shard=(shard_id, num_shards) restricts the sync to one hash shard of the email
+# keyspace, with its own watermarks; see email_marketing.shards. database is a
+# Spanner database or any Repository, e.g. a SqliteRepository for local runs.
+
+
+def update_email_marketing(database, full=False, chunk_size=DEFAULT_CHUNK_SIZE, fingerprint_index_path=None,
+                           workers=None, on_progress=None, shard=None, lookback=DEFAULT_WATERMARK_LOOKBACK):
+    if shard is not None and fingerprint_index_path:
+        # A local index would miss emails other workers wrote for this shard
+        raise ValueError("The fingerprint index cannot be used with sharded syncs")
+
+    try:
+        with SYNC_STAGE_SECONDS.labels(stage='total').time():
+            return _update_email_marketing(
+                as_repository(database), full, chunk_size, fingerprint_index_path, workers, on_progress, shard,
+                lookback)
+    except Exception:
+        SYNC_FAILURES.inc()
+        logger.exception("email_marketing sync failed.")
+        raise
+
+
+def scan_start(source_table, watermark, lookback):
+    if watermark is None or source_table not in APP_TIMESTAMP_SOURCES:
+        return watermark
+    return watermark - lookback
+
+
+def _update_email_marketing(repository, full, chunk_size, fingerprint_index_path, workers, on_progress, shard,
+                            lookback):
+    watermarks = {} if full else repository.get_watermarks()
+    if fingerprint_index_path:
+        dedup = FingerprintDedup(open_index(repository, fingerprint_index_path))
+    else:
+        dedup = QueryDedup()
+
+    current = {}
+
+    def flush(rows):
+        written = dedup.insert(repository, rows)
+        # Rows found to exist only at insert time count as duplicates
+        skipped = len(rows) - len(written)
+        current["stats"]["added"] -= skipped
+        current["stats"]["duplicates"] += skipped
+        SYNC_ROWS_WRITTEN.inc(len(written))
+        dedup.added(normalize_email(email) for email in written.column('email'))
+
+    def record_watermark(watermark):
+        current["stats"]["watermark"] = watermark
+
+    writer = ChunkWriter(flush, chunk_size, lambda: ColumnBatch(EmailMarketing.COLUMNS))
+
+    counts = {}
+    new_watermarks = {}
+
+    # Traverse user_feedback table first, then account table
+    try:
+        for source_table in SOURCE_QUERIES:
+            stats = current["stats"] = {"scanned": 0, "duplicates": 0, "added": 0, "watermark": None}
+            previous = watermarks.get(watermark_key(source_table, shard))
+            with SYNC_STAGE_SECONDS.labels(stage=f'source_{source_table}').time():
+                rows = repository.scan_source(
+                    source_table, scan_start(source_table, previous, lookback), dedup.unseen_only, workers, shard,
+                    on_watermark=record_watermark)
+                writer.write_all(dedup_source_rows(
+                    repository, rows, source_table, writer, stats, chunk_size, dedup, on_progress))
+
+            watermark = stats.pop("watermark")
+            # Rows re-read from the lookback window must not move the watermark back
+            if previous is not None and watermark is not None:
+                watermark = max(watermark, previous)
+            if watermark is not None:
+                new_watermarks[watermark_key(source_table, shard)] = watermark
+            counts[source_table] = stats
+            logger.info("Synced %s: %s", source_table, stats)
+    finally:
+        dedup.close()
+
+    if writer.written:
+        logger.info("%d new entries added to email_marketing table in %d chunks.", writer.written, writer.flushes)
+    else:
+        logger.info("No new entries to add.")
+
+    # Only advance the watermarks once the new entries are committed
+    with SYNC_STAGE_SECONDS.labels(stage='watermarks').time():
+        repository.set_watermarks(new_watermarks)
+
+    peak_rss = peak_rss_mb()
+    logger.info("Peak RSS: %.1f MB", peak_rss)
+
+    return {
+        "mode": "full" if full else "incremental",
+        "chunk_size": chunk_size,
+        "dedup": "fingerprint" if fingerprint_index_path else "query",
+        "workers": workers or 1,
+        "shard": list(shard) if shard is not None else None,
+        "sources": counts,
+        "peak_rss_mb": round(peak_rss, 1),
+    }
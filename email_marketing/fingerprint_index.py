@@ -0,0 +1,207 @@
+import bisect
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+# Compact on-disk set of 64-bit email fingerprints used by the sync to skip
+# emails it has already written, without holding the emails themselves.
+#
+# Files (native byte order, the index is a local cache):
+#   <path>        sorted unique uint64 fingerprints, memory-mapped read-only
+#   <path>.log    fingerprints appended since the last compaction
+#   <path>.bloom  optional Bloom filter over both, checked first
+
+WRITE_BUFFER_SIZE = 65536
+
+
+def fingerprint(normalized_email):
+    digest = hashlib.blake2b(normalized_email.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class BloomFilter:
+    def __init__(self, bits, num_hashes):
+        self.bits = bits
+        self.num_bits = len(bits) * 8
+        self.num_hashes = num_hashes
+
+    @classmethod
+    def for_capacity(cls, capacity, bits_per_key=10):
+        num_bits = max(64, capacity * bits_per_key)
+        # k = ln(2) * bits per key minimises the false positive rate
+        num_hashes = max(1, round(bits_per_key * 0.693))
+        return cls(bytearray((num_bits + 7) // 8), num_hashes)
+
+    def _positions(self, value):
+        # Double hashing on the two halves of the fingerprint
+        h1 = value & 0xFFFFFFFF
+        h2 = (value >> 32) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.num_hashes.to_bytes(4, 'little'))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            num_hashes = int.from_bytes(f.read(4), 'little')
+            return cls(bytearray(f.read()), num_hashes)
+
+
+class FingerprintIndex:
+    def __init__(self, path, use_bloom=True, bloom_bits_per_key=10):
+        self.path = path
+        self.log_path = path + '.log'
+        self.bloom_path = path + '.bloom'
+        self.use_bloom = use_bloom
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self._file = None
+        self._mmap = None
+        self.hashes = array('Q')
+        self.delta = set()
+        self.bloom = None
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            self._file = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.hashes = memoryview(self._mmap).cast('Q')
+
+        if os.path.exists(self.log_path):
+            logged = array('Q')
+            with open(self.log_path, 'rb') as f:
+                data = f.read()
+            # Ignore a partially written trailing fingerprint
+            logged.frombytes(data[:len(data) - len(data) % logged.itemsize])
+            self.delta.update(logged)
+
+        if self.use_bloom and os.path.exists(self.bloom_path):
+            self.bloom = BloomFilter.load(self.bloom_path)
+            for value in self.delta:
+                self.bloom.add(value)
+
+    @classmethod
+    def build(cls, path, fingerprints, use_bloom=True, bloom_bits_per_key=10):
+        hashes = array('Q', _unique(sorted(fingerprints)))
+        cls._write(path, hashes, use_bloom, bloom_bits_per_key)
+        return cls(path, use_bloom=use_bloom, bloom_bits_per_key=bloom_bits_per_key)
+
+    @staticmethod
+    def _write(path, sorted_hashes, use_bloom, bloom_bits_per_key):
+        tmp_path = path + '.tmp'
+        count = 0
+        bloom = None
+        if use_bloom:
+            bloom = BloomFilter.for_capacity(len(sorted_hashes), bloom_bits_per_key)
+
+        with open(tmp_path, 'wb') as f:
+            buffer = array('Q')
+            for value in sorted_hashes:
+                buffer.append(value)
+                if bloom is not None:
+                    bloom.add(value)
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    buffer.tofile(f)
+                    count += len(buffer)
+                    buffer = array('Q')
+            buffer.tofile(f)
+            count += len(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, path)
+        if bloom is not None:
+            bloom.save(path + '.bloom')
+        elif os.path.exists(path + '.bloom'):
+            os.remove(path + '.bloom')
+        if os.path.exists(path + '.log'):
+            os.remove(path + '.log')
+        return count
+
+    def __len__(self):
+        return len(self.hashes) + len(self.delta)
+
+    def __contains__(self, value):
+        if self.bloom is not None and value not in self.bloom:
+            return False
+        if value in self.delta:
+            return True
+        position = bisect.bisect_left(self.hashes, value)
+        return position < len(self.hashes) and self.hashes[position] == value
+
+    def add(self, fingerprints):
+        new_hashes = array('Q', (value for value in fingerprints if value not in self))
+        if not new_hashes:
+            return
+
+        # Persist before updating memory so a crash never loses acknowledged writes
+        with open(self.log_path, 'ab') as f:
+            new_hashes.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.delta.update(new_hashes)
+        if self.bloom is not None:
+            for value in new_hashes:
+                self.bloom.add(value)
+
+    # Merges the appended fingerprints into the sorted file and rebuilds the Bloom filter
+    def compact(self):
+        if not self.delta and not (self.use_bloom and self.bloom is None):
+            return
+
+        merged = array('Q', _unique(heapq.merge(self.hashes, sorted(self.delta))))
+        self._write(self.path, merged, self.use_bloom, self.bloom_bits_per_key)
+        self.close()
+        self.delta = set()
+        self.bloom = None
+        self._load()
+
+    def close(self):
+        if isinstance(self.hashes, memoryview):
+            self.hashes.release()
+        self.hashes = array('Q')
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _unique(sorted_values):
+    previous = None
+    for value in sorted_values:
+        if value != previous:
+            yield value
+            previous = value
+
+
+def build_from_table(repository, path, use_bloom=True):
+    # One-off scan of the normalized email column, keeping only fingerprints
+    fingerprints = array('Q', (fingerprint(email) for email in repository.normalized_emails()))
+    logger.info("Fingerprint index built from %d email_marketing rows.", len(fingerprints))
+    return FingerprintIndex.build(path, fingerprints, use_bloom=use_bloom)
+
+
+def open_index(repository, path, use_bloom=True):
+    if os.path.exists(path):
+        return FingerprintIndex(path, use_bloom=use_bloom)
+    return build_from_table(repository, path, use_bloom=use_bloom)
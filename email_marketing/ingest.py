@@ -0,0 +1,263 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+from google.api_core.exceptions import ClientError
+
+from .bulk_writer import RETRYABLE_ERRORS
+from .email_marketing import (EmailMarketing, generate_unique_id, get_existing_emails, insert_bulk_entries,
+                              normalize_email)
+from .metrics import INGEST_BUFFERED, INGEST_EVENTS, INGEST_FLUSH_SECONDS, SYNC_ROWS_WRITTEN
+from .opt_in import parse_status
+
+logger = logging.getLogger(__name__)
+
+
+# Near-real-time capture of new contacts. Signup and feedback events are posted
+# to the Flask app as they happen and coalesced in memory by normalized email;
+# a background thread flushes them to email_marketing when enough have
+# accumulated or the oldest one has waited long enough, so contacts arrive
+# within minutes without one commit per event. The daily sync still runs and
+# skips anything ingested here through the email index (with a fingerprint
+# index, when the insert that hits it is re-checked).
+
+DEFAULT_FLUSH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 60  # seconds
+DEFAULT_MAX_BUFFERED = 10000
+DEFAULT_ENQUEUE_TIMEOUT = 2  # seconds
+DEFAULT_DEAD_LETTERS = 1000
+
+# Column sizes of email_marketing, checked before an event is buffered
+MAX_EMAIL_LENGTH = 1024
+MAX_NAME_LENGTH = 256
+MAX_SOURCE_LENGTH = 50
+
+
+class BufferFull(Exception):
+    pass
+
+
+def event_field(event, name, max_length, types=(str,)):
+    value = event.get(name)
+    if value is None:
+        return None
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise ValueError(f"Event field {name!r} has the wrong type: {value!r}")
+    value = str(value).strip()
+    if len(value) > max_length:
+        raise ValueError(f"Event field {name!r} is longer than {max_length} characters")
+    return value or None
+
+
+# Rejects events that would not fit email_marketing, so one bad event is a 400
+# for its caller instead of a failed flush for everyone
+
+
+def contact_from_event(event):
+    if not isinstance(event, dict):
+        raise ValueError(f"Event is not an object: {event!r}")
+    email = event_field(event, 'email', MAX_EMAIL_LENGTH)
+    if not email or '@' not in email:
+        raise ValueError(f"Event has no valid email: {event!r}")
+
+    name = event_field(event, 'name', MAX_NAME_LENGTH) or event_field(event, 'username', MAX_NAME_LENGTH)
+    first_name = event_field(event, 'first_name', MAX_NAME_LENGTH) or (name.split()[0] if name else None)
+    last_name = event_field(event, 'last_name', MAX_NAME_LENGTH) or (name.split()[-1] if name else None)
+    source_id = event_field(event, 'source_id', MAX_SOURCE_LENGTH, types=(str, int))
+    opt_in_status = event.get('opt_in_status')
+    return EmailMarketing(
+        id=None,
+        email=email,
+        first_name=first_name,
+        last_name=last_name,
+        source_table=event_field(event, 'source', MAX_SOURCE_LENGTH) or 'event',
+        source_id=source_id or generate_unique_id(),
+        opt_in_status=parse_status(opt_in_status) if opt_in_status is not None else True
+    )
+
+
+def is_data_error(exc):
+    # Errors caused by the rows themselves; retrying the same batch cannot help
+    if isinstance(exc, RETRYABLE_ERRORS):
+        return False
+    return isinstance(exc, (ClientError, ValueError, TypeError))
+
+
+class EventBuffer:
+    def __init__(self, get_database, flush_size=DEFAULT_FLUSH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_buffered=DEFAULT_MAX_BUFFERED, enqueue_timeout=DEFAULT_ENQUEUE_TIMEOUT,
+                 max_dead_letters=DEFAULT_DEAD_LETTERS):
+        # The database is resolved on first flush so the app can start before Spanner is reachable
+        self.get_database = get_database
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.enqueue_timeout = enqueue_timeout
+        self.pending = OrderedDict()  # normalized email -> EmailMarketing
+        self.oldest = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        # Contacts the database refused, with the error, for inspection; never retried
+        self.dead_letters = deque(maxlen=max_dead_letters)
+        self.stats = {"accepted": 0, "coalesced": 0, "rejected": 0, "flushes": 0, "written": 0,
+                      "existing": 0, "failed_flushes": 0, "dead_lettered": 0}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="ingest-flush", daemon=True)
+        self.thread.start()
+        return self
+
+    # Adds a batch of events; events for an email already waiting in the buffer
+    # are coalesced into it. Blocks up to enqueue_timeout for room, then raises
+    # BufferFull so the caller can ask the client to retry later.
+    def add(self, contacts):
+        deadline = time.monotonic() + self.enqueue_timeout
+        accepted = coalesced = 0
+        with self.condition:
+            for contact in contacts:
+                key = normalize_email(contact.email)
+                if key in self.pending:
+                    coalesced += 1
+                    continue
+
+                while len(self.pending) >= self.max_buffered and not self.closed:
+                    self.condition.notify_all()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._count(accepted, coalesced)
+                        INGEST_EVENTS.labels(outcome='rejected').inc()
+                        self.stats["rejected"] += 1
+                        raise BufferFull(f"Ingestion buffer is full ({self.max_buffered} contacts)")
+                    self.condition.wait(remaining)
+                if self.closed:
+                    raise BufferFull("Ingestion buffer is closed")
+
+                if not self.pending:
+                    self.oldest = time.monotonic()
+                self.pending[key] = contact
+                accepted += 1
+
+            self._count(accepted, coalesced)
+            if len(self.pending) >= self.flush_size:
+                self.condition.notify_all()
+        return accepted, coalesced
+
+    def _count(self, accepted, coalesced):
+        self.stats["accepted"] += accepted
+        self.stats["coalesced"] += coalesced
+        INGEST_EVENTS.labels(outcome='accepted').inc(accepted)
+        INGEST_EVENTS.labels(outcome='coalesced').inc(coalesced)
+        INGEST_BUFFERED.set(len(self.pending))
+
+    def _due(self):
+        return self.pending and (len(self.pending) >= self.flush_size
+                                 or time.monotonic() - self.oldest >= self.flush_interval)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self._due():
+                    timeout = self.flush_interval
+                    if self.pending:
+                        timeout = max(self.oldest + self.flush_interval - time.monotonic(), 0)
+                    self.condition.wait(timeout)
+                if self.closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # The contacts were put back; back off before trying again
+                logger.exception("Ingestion flush failed.")
+                time.sleep(min(self.flush_interval, 5))
+
+    def flush(self):
+        with self.flush_lock:
+            with self.condition:
+                contacts = self.pending
+                self.pending = OrderedDict()
+                self.oldest = None
+                INGEST_BUFFERED.set(0)
+                # Room freed for producers waiting on a full buffer
+                self.condition.notify_all()
+            if not contacts:
+                return 0
+
+            try:
+                with INGEST_FLUSH_SECONDS.time():
+                    try:
+                        written = self._write(contacts)
+                    except Exception as e:
+                        if not is_data_error(e):
+                            raise
+                        written = self._isolate(contacts, list(contacts), e)
+            except Exception:
+                # Transient failure: everything not dead-lettered is retried
+                self._requeue(contacts)
+                self.stats["failed_flushes"] += 1
+                raise
+            self.stats["flushes"] += 1
+            return written
+
+    # Halves a batch the database refused until the offending contacts are on
+    # their own; those are dead-lettered and the rest written
+    def _isolate(self, contacts, keys, error):
+        if len(keys) == 1:
+            self._dead_letter(contacts.pop(keys[0]), error)
+            return 0
+        middle = len(keys) // 2
+        return self._write_or_isolate(contacts, keys[:middle]) + self._write_or_isolate(contacts, keys[middle:])
+
+    def _write_or_isolate(self, contacts, keys):
+        try:
+            return self._write(OrderedDict((key, contacts[key]) for key in keys))
+        except Exception as e:
+            if not is_data_error(e):
+                raise
+            return self._isolate(contacts, keys, e)
+
+    def _dead_letter(self, contact, error):
+        self.dead_letters.append((contact, str(error)))
+        self.stats["dead_lettered"] += 1
+        INGEST_EVENTS.labels(outcome='dead_letter').inc()
+        logger.error("Dropping ingested contact %s the database refused: %s", contact.email, error)
+
+    def _write(self, contacts):
+        database = self.get_database()
+        # A contact may have reached email_marketing through the sync or an
+        # earlier flush since it was buffered
+        existing = get_existing_emails(database, contacts.keys())
+        new_contacts = [contact for key, contact in contacts.items() if key not in existing]
+        if new_contacts:
+            insert_bulk_entries(database, new_contacts)
+
+        SYNC_ROWS_WRITTEN.inc(len(new_contacts))
+        INGEST_EVENTS.labels(outcome='existing').inc(len(existing))
+        self.stats["written"] += len(new_contacts)
+        self.stats["existing"] += len(existing)
+        logger.info("Ingestion flush wrote %d contacts, %d already known.", len(new_contacts), len(existing))
+        return len(new_contacts)
+
+    def _requeue(self, contacts):
+        # Failed contacts go back in front of anything buffered since; on the
+        # retry the existing-email check drops any that did get committed
+        with self.condition:
+            for key, contact in self.pending.items():
+                contacts.setdefault(key, contact)
+            self.pending = contacts
+            self.oldest = time.monotonic()
+            INGEST_BUFFERED.set(len(self.pending))
+
+    def close(self):
+        # Stops the flusher and writes out whatever is still buffered
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final ingestion flush failed; %d contacts were not written.", len(self.pending))
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Background execution of the email_marketing sync for the Flask app. Only one
+# sync runs per process at a time: triggers that arrive while it is running
+# attach to the running job instead of starting another one.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+MAX_JOB_HISTORY = 100
+
+
+class Job:
+    def __init__(self, id, params):
+        self.id = id
+        self.params = params
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def active(self):
+        return self.status in (QUEUED, RUNNING)
+
+    def update_progress(self, source, stats):
+        self.progress[source] = dict(stats)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobRunner:
+    def __init__(self, max_history=MAX_JOB_HISTORY):
+        self.max_history = max_history
+        self.jobs = OrderedDict()
+        self.current = None
+        self.lock = threading.Lock()
+
+    # Returns (job, started); started is False when attached to a running job
+    def submit(self, fn, params):
+        with self.lock:
+            if self.current is not None and self.current.active:
+                return self.current, False
+
+            job = Job(str(uuid.uuid4()), params)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_history:
+                self.jobs.popitem(last=False)
+            self.current = job
+
+        threading.Thread(target=self._run, args=(job, fn), name=f"job-{job.id}", daemon=True).start()
+        return job, True
+
+    def _run(self, job, fn):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            job.result = fn(job.update_progress)
+            job.status = SUCCEEDED
+        except Exception as e:
+            logger.exception("Job %s failed.", job.id)
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            with self.lock:
+                if self.current is job:
+                    self.current = None
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
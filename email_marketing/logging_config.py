@@ -0,0 +1,32 @@
+import json
+import logging
+import os
+
+
+# Leveled logging for both entry points. LOG_LEVEL sets the level (default INFO);
+# LOG_FORMAT=json emits one JSON object per line, which Cloud Logging parses.
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(level=None, fmt=None):
+    handler = logging.StreamHandler()
+    if (fmt or os.getenv("LOG_FORMAT", "text")) == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level or os.getenv("LOG_LEVEL", "INFO"))
@@ -1,51 +1,148 @@
+import atexit
+import io
 import os
-from google.cloud import spanner
+from datetime import timedelta
 from flask import Flask, request
-from dotenv import load_dotenv
 
 from .account import populate_test_entries as populate_account_entries
-from .account import read_all_entries as read_all_account_entries
 from .user_feedback import populate_test_entries as populate_user_feedback_entries
-from .user_feedback import read_all_entries as read_all_user_feedback_entries
+from .connection import get_database, warm_up
+from .logging_config import configure_logging
+from .metrics import metrics_response
 from .email_marketing import read_all_entries as read_all_email_marketing_entries
 from .email_marketing import truncate_table
 from .email_marketing import update_email_marketing
+from .email_marketing import DEFAULT_CHUNK_SIZE, DEFAULT_WATERMARK_LOOKBACK
+from .ingest import BufferFull, EventBuffer, contact_from_event
+from .jobs import JobRunner
+from .migrations import empty_tables, migrate
+from .segments import refresh_segments
+from .opt_in import DEFAULT_OPT_IN_CHUNK_SIZE, READERS, bulk_update_opt_in_status, parse_status
 
-load_dotenv()
 
-# Set the Spanner emulator host and disable credentials
-os.environ["SPANNER_EMULATOR_HOST"] = os.getenv("SPANNER_EMULATOR_HOST")
-os.environ["GOOGLE_CLOUD_PROJECT"] = os.getenv("GOOGLE_CLOUD_PROJECT")
-os.environ["SPANNER_EMULATOR_CREDENTIALS"] = os.getenv(
-    "SPANNER_EMULATOR_CREDENTIALS")
+configure_logging()
 
-# Initialize the Spanner client
-spanner_client = spanner.Client()
+# Initialize the Flask app
+app = Flask(__name__)
 
-# Define the instance and database
-instance_id = 'test-instance'
-database_id = 'test-database'
-instance = spanner_client.instance(instance_id)
-database = instance.database(database_id)
+# Create the Spanner client and session pool off the first request's path
+if os.getenv("SPANNER_WARM_UP", "true").lower() in ('1', 'true', 'yes'):
+    warm_up()
 
 
-# Initialize the Flask app
-app = Flask(__name__)
+# Syncs run in the background, one at a time per process
+sync_jobs = JobRunner()
+
+# Events posted to /events are buffered and written to email_marketing in batches
+event_buffer = EventBuffer(
+    get_database,
+    flush_size=int(os.getenv("INGEST_FLUSH_SIZE", 500)),
+    flush_interval=int(os.getenv("INGEST_FLUSH_INTERVAL", 60)),
+    max_buffered=int(os.getenv("INGEST_MAX_BUFFERED", 10000))
+).start()
+atexit.register(event_buffer.close)
 
 
 @app.route('/update_email_marketing', methods=['POST'])
 def update_email_marketing_route():
-    return update_email_marketing(database)
+    # ?full=true rescans every source instead of reading past the watermarks
+    full = request.args.get('full', 'false').lower() in ('1', 'true', 'yes')
+    chunk_size = request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int)
+    # ?workers=N reads each source as N parallel partitions
+    workers = request.args.get('workers', type=int)
+    # ?lookback_seconds=N re-reads user_feedback this far before its watermark
+    lookback_seconds = request.args.get(
+        'lookback_seconds', int(os.getenv("SYNC_LOOKBACK_SECONDS", DEFAULT_WATERMARK_LOOKBACK.total_seconds())),
+        type=int)
+    params = {"full": full, "chunk_size": chunk_size, "workers": workers, "lookback_seconds": lookback_seconds}
+
+    def run_sync(on_progress):
+        database = get_database()
+        result = update_email_marketing(
+            database, full=full, chunk_size=chunk_size,
+            fingerprint_index_path=os.getenv("EMAIL_FINGERPRINT_INDEX"), workers=workers,
+            on_progress=on_progress, lookback=timedelta(seconds=lookback_seconds))
+        # Bring the segment caches up to date with the new entries
+        result["segments"] = refresh_segments(database)
+        return result
+
+    # A trigger that arrives while a sync is running attaches to that job
+    job, started = sync_jobs.submit(run_sync, params)
+    return {"job_id": job.id, "status": job.status, "attached": not started}, 202
+
+
+@app.route('/update_email_marketing/<job_id>', methods=['GET'])
+def update_email_marketing_status_route(job_id):
+    job = sync_jobs.get(job_id)
+    if job is None:
+        return {"error": f"Unknown job {job_id}"}, 404
+    return job.to_dict()
+
+
+@app.route('/events', methods=['POST'])
+def events_route():
+    # A single event or a list of them, e.g. {"email": ..., "name": ..., "source": "signup"}
+    events = request.get_json(silent=True)
+    if isinstance(events, dict):
+        events = [events]
+    if not isinstance(events, list):
+        return {"error": "Expected a JSON event or a list of events"}, 400
+
+    try:
+        contacts = [contact_from_event(event) for event in events]
+    except (ValueError, AttributeError) as e:
+        return {"error": str(e)}, 400
+
+    try:
+        accepted, coalesced = event_buffer.add(contacts)
+    except BufferFull as e:
+        return {"error": str(e)}, 503, {"Retry-After": str(event_buffer.flush_interval)}
+    return {"accepted": accepted, "coalesced": coalesced}, 202
+
+
+@app.route('/opt_in_status', methods=['POST'])
+def opt_in_status_route():
+    # ?format=csv|ndjson|json, otherwise taken from the Content-Type
+    fmt = request.args.get('format') or request.mimetype.split('/')[-1].replace('x-', '')
+    if fmt not in READERS:
+        return {"error": f"Unsupported format {fmt!r}, expected one of {', '.join(READERS)}"}, 415
+    # ?status=false applies to records without their own status, e.g. an unsubscribe list
+    default_status = request.args.get('status')
+    chunk_size = request.args.get('chunk_size', DEFAULT_OPT_IN_CHUNK_SIZE, type=int)
+
+    try:
+        if default_status is not None:
+            default_status = parse_status(default_status)
+        # The body is read as it is processed rather than loaded up front
+        items = READERS[fmt](io.TextIOWrapper(request.stream, encoding='utf-8'))
+        return bulk_update_opt_in_status(
+            get_database(), items, default_status=default_status, chunk_size=chunk_size)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    return metrics_response()
 
 
 if __name__ == '__main__':
-    if read_all_account_entries(database) == None:
+    database = get_database()
+    migrate(database)
+    # Sample rows only go into empty tables
+    empty = empty_tables(database, ('account', 'user_feedback'))
+    if 'account' in empty:
         populate_account_entries(database)
-    if read_all_user_feedback_entries(database) == None:
+    if 'user_feedback' in empty:
         populate_user_feedback_entries(database)
     app.run(port=8080, debug=True)
 
 # curl -X POST http://localhost:8080/update_email_marketing
+# curl -X POST "http://localhost:8080/update_email_marketing?full=true"
+# curl http://localhost:8080/update_email_marketing/<job_id>
+# curl http://localhost:8080/metrics
+# curl -X POST -H "Content-Type: application/json" -d '{"email": "jane@example.com", "name": "Jane Doe", "source": "signup"}' http://localhost:8080/events
+# curl -X POST -H "Content-Type: text/csv" --data-binary @unsubscribes.csv "http://localhost:8080/opt_in_status?status=false"
 
 
 # Cron jobs
@@ -0,0 +1,40 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+
+# Prometheus metrics for the email_marketing sync and the mail_trap senders,
+# served on /metrics by the Flask app. Hot loops update them once per chunk.
+
+SYNC_ROWS_SCANNED = Counter(
+    'email_marketing_sync_rows_scanned_total', 'Source rows read by the email_marketing sync', ['source'])
+SYNC_DUPLICATES_SKIPPED = Counter(
+    'email_marketing_sync_duplicates_skipped_total', 'Source rows skipped because the email is already known',
+    ['source'])
+SYNC_ROWS_WRITTEN = Counter(
+    'email_marketing_sync_rows_written_total', 'Rows committed to email_marketing by the sync')
+SYNC_FAILURES = Counter(
+    'email_marketing_sync_failures_total', 'email_marketing sync runs that raised')
+SYNC_STAGE_SECONDS = Histogram(
+    'email_marketing_sync_stage_seconds', 'Time spent in each stage of the email_marketing sync', ['stage'])
+COMMIT_SECONDS = Histogram(
+    'email_marketing_commit_seconds', 'Latency of bulk write commits', ['table'])
+COMMIT_RETRIES = Counter(
+    'email_marketing_commit_retries_total', 'Bulk write commits retried after Aborted or ServiceUnavailable',
+    ['table'])
+
+INGEST_EVENTS = Counter(
+    'email_marketing_ingest_events_total', 'Events received by the ingestion endpoint by outcome', ['outcome'])
+INGEST_BUFFERED = Gauge(
+    'email_marketing_ingest_buffered', 'Contacts waiting in the ingestion buffer')
+INGEST_FLUSH_SECONDS = Histogram(
+    'email_marketing_ingest_flush_seconds', 'Time to flush the ingestion buffer to email_marketing')
+
+SEND_SECONDS = Histogram(
+    'mail_trap_send_seconds', 'Latency of one send, including retries', ['mode'])
+SENDS = Counter(
+    'mail_trap_sends_total', 'Emails handed to Mailtrap by outcome', ['mode', 'outcome'])
+SEND_RETRIES = Counter(
+    'mail_trap_send_retries_total', 'Send attempts that were retried', ['mode'])
+
+
+def metrics_response():
+    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
@@ -0,0 +1,356 @@
+import argparse
+import json
+import logging
+import re
+from collections import namedtuple
+
+from google.cloud import spanner
+
+from .connection import get_database
+from .logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+# Versioned schema of the database, for the sync, the sender and their
+# bookkeeping tables. migrate() reads the applied versions and the existing
+# tables, columns and indexes in one snapshot, then applies the DDL of every
+# pending migration in a single update_ddl operation and records the versions
+# in schema_version. Databases created before schema_version existed are
+# adopted: a statement whose table, column or index is already there is
+# skipped, and its migration is just recorded.
+#
+# Add a migration by appending to MIGRATIONS with the next version; never
+# edit one that has been released.
+#
+#   python -m email_marketing.migrations                 # apply pending migrations
+#   python -m email_marketing.migrations --dry-run       # print the pending DDL
+#   python -m email_marketing.migrations --dedup-emails  # drop case/whitespace duplicates, then migrate
+
+# (kind, name) of the schema object a statement creates, and the statement
+Ddl = namedtuple('Ddl', ['kind', 'name', 'sql'])
+Migration = namedtuple('Migration', ['version', 'name', 'statements'])
+
+EMAIL_INDEX = 'email_marketing_email_normalized'
+
+# Secondary indexes for segment queries (see email_marketing.segments). They
+# store the columns a recipient needs, so segment reads never touch the base
+# table; the updated_at index finds the rows changed since a refresh.
+SOURCE_INDEX = 'email_marketing_source_opt_in_created'
+OPT_IN_INDEX = 'email_marketing_opt_in_created'
+UPDATED_AT_INDEX = 'email_marketing_updated_at'
+
+# Indexes on the sources' change-tracking timestamps, so an incremental sync
+# reads only the range past its watermark. They store the columns the sync
+# selects, so the scan never touches the base tables.
+USER_FEEDBACK_CREATION_INDEX = 'user_feedback_creation_time'
+ACCOUNT_UPDATED_AT_INDEX = 'account_updated_at'
+
+SCHEMA_VERSION_DDL = """
+    CREATE TABLE schema_version (
+        version INT64 NOT NULL,
+        name STRING(100) NOT NULL,
+        applied_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+    ) PRIMARY KEY (version)
+    """
+
+MIGRATIONS = [
+    Migration(1, 'create account', [
+        Ddl('table', 'account', """
+        CREATE TABLE account (
+            id STRING(MAX) NOT NULL,
+            email STRING(MAX) NOT NULL,
+            auth_type STRING(MAX) NOT NULL,
+            password STRING(MAX) NOT NULL,
+            account_name STRING(MAX),
+            status STRING(MAX) NOT NULL,
+            more_info JSON NOT NULL,
+            created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+            updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+            created_by STRING(MAX) NOT NULL,
+            updated_by STRING(MAX) NOT NULL,
+            version INT64 NOT NULL
+        ) PRIMARY KEY (id)
+        """),
+    ]),
+    Migration(2, 'create user_feedback', [
+        Ddl('table', 'user_feedback', """
+        CREATE TABLE user_feedback (
+            id STRING(50) NOT NULL,
+            feedback_type STRING(20) NOT NULL,
+            creation_time TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+            username STRING(100) NOT NULL,
+            email STRING(1024) NOT NULL,
+            full_name STRING(1024) NOT NULL,
+            content STRING(8192) NOT NULL,
+            user_ip STRING(256) NOT NULL,
+            user_agent STRING(1024) NOT NULL
+        ) PRIMARY KEY (id)
+        """),
+    ]),
+    Migration(3, 'create email_marketing', [
+        Ddl('table', 'email_marketing', """
+        CREATE TABLE email_marketing (
+            id STRING(50) NOT NULL,
+            email STRING(1024) NOT NULL,
+            first_name STRING(256),
+            last_name STRING(256),
+            source_table STRING(50) NOT NULL,
+            source_id STRING(50) NOT NULL,
+            opt_in_status BOOL NOT NULL,
+            created_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+            updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+        ) PRIMARY KEY (id)
+        """),
+    ]),
+    # Emails are deduplicated on their normalized form through a unique index.
+    # migrate() refuses to apply it while the table holds emails that only
+    # differ by case or whitespace; see dedup_emails.
+    Migration(4, 'unique normalized email', [
+        Ddl('column', 'email_marketing.email_normalized', """
+        ALTER TABLE email_marketing
+        ADD COLUMN email_normalized STRING(1024) AS (LOWER(TRIM(email))) STORED
+        """),
+        Ddl('index', EMAIL_INDEX,
+            f"CREATE UNIQUE NULL_FILTERED INDEX {EMAIL_INDEX} ON email_marketing (email_normalized)"),
+    ]),
+    Migration(5, 'create sync_state', [
+        Ddl('table', 'sync_state', """
+        CREATE TABLE sync_state (
+            source STRING(100) NOT NULL,
+            watermark TIMESTAMP NOT NULL,
+            updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+        ) PRIMARY KEY (source)
+        """),
+    ]),
+    Migration(6, 'create sync_lease', [
+        Ddl('table', 'sync_lease', """
+        CREATE TABLE sync_lease (
+            run_id STRING(64) NOT NULL,
+            shard_id INT64 NOT NULL,
+            num_shards INT64 NOT NULL,
+            owner STRING(256),
+            expires_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            result STRING(MAX),
+        ) PRIMARY KEY (run_id, shard_id)
+        """),
+    ]),
+    Migration(7, 'segment indexes', [
+        Ddl('index', SOURCE_INDEX,
+            f"CREATE INDEX {SOURCE_INDEX} ON email_marketing (source_table, opt_in_status, created_at) "
+            "STORING (email, first_name)"),
+        Ddl('index', OPT_IN_INDEX,
+            f"CREATE INDEX {OPT_IN_INDEX} ON email_marketing (opt_in_status, created_at) "
+            "STORING (email, first_name, source_table)"),
+        Ddl('index', UPDATED_AT_INDEX,
+            f"CREATE INDEX {UPDATED_AT_INDEX} ON email_marketing (updated_at) "
+            "STORING (email, first_name, source_table, opt_in_status, created_at)"),
+    ]),
+    Migration(8, 'create segment', [
+        Ddl('table', 'segment', """
+        CREATE TABLE segment (
+            segment_name STRING(100) NOT NULL,
+            source_table STRING(50),
+            opted_in_only BOOL NOT NULL,
+            created_after TIMESTAMP,
+            created_before TIMESTAMP,
+            updated_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+        ) PRIMARY KEY (segment_name)
+        """),
+        Ddl('table', 'segment_member', """
+        CREATE TABLE segment_member (
+            segment_name STRING(100) NOT NULL,
+            email_marketing_id STRING(50) NOT NULL,
+            email STRING(1024) NOT NULL,
+            first_name STRING(256),
+            added_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+        ) PRIMARY KEY (segment_name, email_marketing_id),
+          INTERLEAVE IN PARENT segment ON DELETE CASCADE
+        """),
+    ]),
+    Migration(9, 'create send_log', [
+        Ddl('table', 'send_log', """
+        CREATE TABLE send_log (
+            campaign_id STRING(100) NOT NULL,
+            email_marketing_id STRING(50) NOT NULL,
+            email STRING(1024) NOT NULL,
+            status STRING(20) NOT NULL,
+            error STRING(MAX),
+            sent_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+        ) PRIMARY KEY (campaign_id, email_marketing_id)
+        """),
+    ]),
+    Migration(10, 'create suppression', [
+        Ddl('table', 'suppression', """
+        CREATE TABLE suppression (
+            email_normalized STRING(1024) NOT NULL,
+            email STRING(1024) NOT NULL,
+            reason STRING(20) NOT NULL,
+            detail STRING(MAX),
+            suppressed_at TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
+        ) PRIMARY KEY (email_normalized)
+        """),
+    ]),
+    Migration(11, 'source timestamp indexes', [
+        Ddl('index', USER_FEEDBACK_CREATION_INDEX,
+            f"CREATE INDEX {USER_FEEDBACK_CREATION_INDEX} ON user_feedback (creation_time) STORING (email, username)"),
+        Ddl('index', ACCOUNT_UPDATED_AT_INDEX,
+            f"CREATE INDEX {ACCOUNT_UPDATED_AT_INDEX} ON account (updated_at) STORING (email, account_name)"),
+    ]),
+]
+
+# Every table, column and index of the default schema, as (kind, name)
+SCHEMA_OBJECTS_SQL = """
+    SELECT 'table', table_name FROM information_schema.tables WHERE table_schema = ''
+    UNION ALL
+    SELECT 'column', CONCAT(table_name, '.', column_name) FROM information_schema.columns WHERE table_schema = ''
+    UNION ALL
+    SELECT 'index', index_name FROM information_schema.indexes WHERE table_schema = '' AND index_type = 'INDEX'
+    """
+
+
+# Table, key columns and STORING columns of a CREATE INDEX statement
+INDEX_COLUMNS = re.compile(r"\bON\s+(\w+)\s*\(([^)]*)\)(?:\s*STORING\s*\(([^)]*)\))?", re.IGNORECASE)
+
+
+def extra_mutations(table, migrations=MIGRATIONS):
+    # Mutations a row written to table counts beyond its own columns: one per
+    # column added by a later migration (e.g. a generated column) and, for
+    # each secondary index, one per key and STORING column
+    count = 0
+    for migration in migrations:
+        for ddl in migration.statements:
+            if ddl.kind == 'column' and ddl.name.startswith(table + '.'):
+                count += 1
+            elif ddl.kind == 'index':
+                match = INDEX_COLUMNS.search(ddl.sql)
+                if match and match.group(1) == table:
+                    count += sum(len([c for c in (group or '').split(',') if c.strip()])
+                                 for group in match.group(2, 3))
+    return count
+
+
+class DuplicateEmails(Exception):
+    pass
+
+
+# Emails of email_marketing that only differ by case or whitespace, with their counts
+DUPLICATE_EMAILS_SQL = """
+    SELECT LOWER(TRIM(email)) AS email_normalized, COUNT(*) AS count FROM email_marketing
+    GROUP BY email_normalized HAVING COUNT(*) > 1 ORDER BY count DESC LIMIT @limit
+    """
+
+# Keeps the oldest row of each normalized email (by created_at, then id)
+DEDUP_EMAILS_SQL = """
+    DELETE FROM email_marketing AS em WHERE EXISTS (
+        SELECT 1 FROM email_marketing AS other
+        WHERE LOWER(TRIM(other.email)) = LOWER(TRIM(em.email))
+          AND (other.created_at < em.created_at OR (other.created_at = em.created_at AND other.id < em.id)))
+    """
+
+
+def find_duplicate_emails(database, limit=10):
+    with database.snapshot() as snapshot:
+        return [(row[0], row[1]) for row in snapshot.execute_sql(
+            DUPLICATE_EMAILS_SQL, params={"limit": limit}, param_types={"limit": spanner.param_types.INT64})]
+
+
+def dedup_emails(database):
+    # send_log and segment_member rows of the deleted entries are left as they are
+    deleted = database.run_in_transaction(lambda transaction: transaction.execute_update(DEDUP_EMAILS_SQL))
+    logger.info("Deleted %d duplicate email_marketing entries.", deleted)
+    return deleted
+
+
+def check_unique_emails(database, existing, pending):
+    # The unique email index cannot be built over duplicates; say so before the DDL runs
+    if ('table', 'email_marketing') not in existing or ('index', EMAIL_INDEX) in existing:
+        return
+    if not any(ddl.name == EMAIL_INDEX for migration in pending for ddl in migration.statements):
+        return
+    duplicates = find_duplicate_emails(database)
+    if duplicates:
+        examples = ", ".join(f"{email} ({count} rows)" for email, count in duplicates)
+        raise DuplicateEmails(
+            f"email_marketing holds emails that only differ by case or whitespace, so the unique index "
+            f"{EMAIL_INDEX} cannot be created: {examples}. Run "
+            f"'python -m email_marketing.migrations --dedup-emails' to keep the oldest entry of each.")
+
+
+def read_schema(database):
+    # Existing schema objects and applied versions, from one snapshot
+    with database.snapshot(multi_use=True) as snapshot:
+        existing = {(row[0], row[1]) for row in snapshot.execute_sql(SCHEMA_OBJECTS_SQL)}
+        applied = set()
+        if ('table', 'schema_version') in existing:
+            applied = {row[0] for row in snapshot.execute_sql("SELECT version FROM schema_version")}
+    return existing, applied
+
+
+def pending_statements(existing, pending):
+    statements = [] if ('table', 'schema_version') in existing else [SCHEMA_VERSION_DDL]
+    for migration in pending:
+        statements += [ddl.sql for ddl in migration.statements if (ddl.kind, ddl.name) not in existing]
+    return statements
+
+
+def migrate(database, migrations=MIGRATIONS):
+    existing, applied = read_schema(database)
+    pending = [migration for migration in migrations if migration.version not in applied]
+    if not pending:
+        logger.info("Schema is up to date at version %d.", max(applied, default=0))
+        return []
+
+    check_unique_emails(database, existing, pending)
+
+    # One long-running operation for all of the pending DDL
+    statements = pending_statements(existing, pending)
+    if statements:
+        operation = database.update_ddl(statements)
+        logger.info("Waiting for %d DDL statements to complete...", len(statements))
+        operation.result()
+
+    with database.batch() as batch:
+        batch.insert_or_update(
+            table='schema_version',
+            columns=('version', 'name', 'applied_at'),
+            values=[(migration.version, migration.name, spanner.COMMIT_TIMESTAMP) for migration in pending]
+        )
+    versions = [migration.version for migration in pending]
+    logger.info("Schema migrated to version %d (applied %s).", versions[-1], versions)
+    return versions
+
+
+# Which of the tables hold no rows, with one query of LIMIT 1 probes
+
+
+def empty_tables(database, tables):
+    probes = ', '.join(f"EXISTS(SELECT 1 FROM {table} LIMIT 1)" for table in tables)
+    with database.snapshot() as snapshot:
+        row = list(snapshot.execute_sql(f"SELECT {probes}"))[0]
+    return {table for table, has_rows in zip(tables, row) if not has_rows}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations.")
+    parser.add_argument("--dry-run", action="store_true", help="print the pending DDL without applying it")
+    parser.add_argument("--dedup-emails", action="store_true",
+                        help="delete email_marketing entries whose email only differs by case or whitespace "
+                             "from an older one, before migrating")
+    args = parser.parse_args()
+
+    configure_logging()
+    database = get_database()
+    if args.dry_run:
+        existing, applied = read_schema(database)
+        pending = [migration for migration in MIGRATIONS if migration.version not in applied]
+        print(json.dumps({
+            "applied": sorted(applied),
+            "pending": [migration.version for migration in pending],
+            "statements": [" ".join(sql.split()) for sql in pending_statements(existing, pending)] if pending else []
+        }, indent=2))
+    else:
+        deleted = dedup_emails(database) if args.dedup_emails else 0
+        print(json.dumps({"deleted_duplicates": deleted, "applied": migrate(database)}))
@@ -0,0 +1,159 @@
+import csv
+import json
+import logging
+from collections import namedtuple
+
+from google.cloud import spanner
+
+from .bulk_writer import write_rows
+from .email_marketing import EMAIL_INDEX, EMAIL_MARKETING_EXTRA_MUTATIONS, normalize_email
+from .pipeline import chunked
+
+logger = logging.getLogger(__name__)
+
+
+# Bulk opt-in/opt-out updates, e.g. from an unsubscribe export. Records are
+# processed in chunks: emails are resolved to ids through the email index, the
+# current statuses are read by primary key, and only the rows whose status
+# actually changes are written, in commits sized by the bulk writer.
+
+OPT_IN_COLUMNS = ('id', 'opt_in_status', 'updated_at')
+
+DEFAULT_OPT_IN_CHUNK_SIZE = 5000
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'opt_in', 'opted_in', 'subscribe', 'subscribed')
+FALSE_VALUES = ('0', 'false', 'no', 'n', 'opt_out', 'opted_out', 'unsubscribe', 'unsubscribed')
+
+OptInRecord = namedtuple('OptInRecord', ['id', 'email', 'opt_in_status'])
+
+
+def parse_status(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in TRUE_VALUES:
+        return True
+    if isinstance(value, str) and value.strip().lower() in FALSE_VALUES:
+        return False
+    raise ValueError(f"Invalid opt-in status {value!r}")
+
+
+# Accepts {"id": ...} or {"email": ...} with an "opt_in_status" (or "status")
+# field; default_status applies to records without one, e.g. a plain email list
+
+
+def to_opt_in_record(item, default_status=None):
+    id = item.get('id') or None
+    email = item.get('email') or None
+    if id is None and email is None:
+        raise ValueError("Record has neither an id nor an email")
+
+    status = item.get('opt_in_status', item.get('status'))
+    if status is None or status == '':
+        if default_status is None:
+            raise ValueError("Record has no opt-in status")
+        status = default_status
+    return OptInRecord(id, email, parse_status(status))
+
+
+# Readers for the accepted upload formats; all of them yield dicts lazily except
+# a JSON array, which has to be parsed whole
+
+
+def read_csv(stream):
+    return csv.DictReader(stream)
+
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Passed through so the bad line is counted as invalid
+            yield line
+
+
+def read_json(stream):
+    data = json.load(stream)
+    if isinstance(data, dict):
+        data = data.get('records', [data])
+    return iter(data)
+
+
+READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+    'json': read_json
+}
+
+
+def bulk_update_opt_in_status(database, items, default_status=None, chunk_size=DEFAULT_OPT_IN_CHUNK_SIZE):
+    stats = {"received": 0, "applied": 0, "unchanged": 0, "unknown": 0, "invalid": 0, "superseded": 0}
+
+    for chunk in chunked(items, chunk_size):
+        records = []
+        for item in chunk:
+            stats["received"] += 1
+            try:
+                records.append(to_opt_in_record(item, default_status))
+            except (ValueError, AttributeError) as e:
+                logger.debug("Skipping invalid opt-in record %r: %s", item, e)
+                stats["invalid"] += 1
+
+        updates = apply_opt_in_chunk(database, records, stats)
+        logger.debug("Opt-in chunk of %d records: %d updated.", len(chunk), updates)
+
+    logger.info("Bulk opt-in update finished: %s.", stats)
+    return stats
+
+
+def apply_opt_in_chunk(database, records, stats):
+    emails = {normalize_email(record.email) for record in records if record.id is None}
+
+    with database.snapshot(multi_use=True) as snapshot:
+        ids_by_email = {}
+        if emails:
+            results = snapshot.read(
+                table='email_marketing',
+                columns=('email_normalized', 'id'),
+                keyset=spanner.KeySet(keys=[[email] for email in emails]),
+                index=EMAIL_INDEX
+            )
+            ids_by_email = {row[0]: row[1] for row in results}
+
+        # Later records for the same id win; the earlier ones count as superseded
+        targets = {}
+        for record in records:
+            id = record.id if record.id is not None else ids_by_email.get(normalize_email(record.email))
+            if id is None:
+                stats["unknown"] += 1
+            else:
+                if id in targets:
+                    stats["superseded"] += 1
+                targets[id] = record.opt_in_status
+
+        current = {}
+        if targets:
+            results = snapshot.read(
+                table='email_marketing',
+                columns=('id', 'opt_in_status'),
+                keyset=spanner.KeySet(keys=[[id] for id in targets])
+            )
+            current = {row[0]: row[1] for row in results}
+
+    values = []
+    for id, status in targets.items():
+        if id not in current:
+            stats["unknown"] += 1
+        elif current[id] == status:
+            stats["unchanged"] += 1
+        else:
+            values.append((id, status, spanner.COMMIT_TIMESTAMP))
+
+    if values:
+        write_rows(database, 'email_marketing', OPT_IN_COLUMNS, values, mode='update', workers=1,
+                   mutations_per_row=len(OPT_IN_COLUMNS) + EMAIL_MARKETING_EXTRA_MUTATIONS)
+        stats["applied"] += len(values)
+    return len(values)
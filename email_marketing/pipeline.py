@@ -0,0 +1,146 @@
+import queue
+import resource
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+
+# Building blocks for the streaming email_marketing sync. Rows flow through
+# generators so memory is bounded by the chunk size instead of the table size.
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# before(snapshot), if given, runs in the same snapshot ahead of the query,
+# e.g. to read an aggregate that has to be consistent with the streamed rows
+
+
+def stream_query(database, sql, params=None, param_types=None, before=None):
+    # The snapshot stays open while the caller consumes the rows
+    with database.snapshot(multi_use=before is not None) as snapshot:
+        if before is not None:
+            before(snapshot)
+        results = snapshot.execute_sql(
+            sql, params=params, param_types=param_types)
+        for row in results:
+            yield row
+
+
+PARTITION_ROW_BATCH_SIZE = 500
+PARTITION_QUEUE_SIZE = 64
+_PARTITION_DONE = object()
+
+
+# Splits the query into partitions of one batch snapshot and reads them on a
+# thread pool (the gRPC streams release the GIL). Rows from all partitions are
+# merged through a bounded queue, so readers stall instead of buffering when the
+# consumer falls behind. The query must be root-partitionable.
+
+
+def stream_partitioned_query(database, sql, params=None, param_types=None, workers=4, before=None):
+    batch_snapshot = database.batch_snapshot()
+    rows = queue.Queue(maxsize=PARTITION_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                rows.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read_partition(partition):
+        try:
+            buffer = []
+            for row in batch_snapshot.process_query_batch(partition):
+                buffer.append(row)
+                if len(buffer) >= PARTITION_ROW_BATCH_SIZE:
+                    put(buffer)
+                    buffer = []
+                    if stop.is_set():
+                        return
+            if buffer:
+                put(buffer)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_PARTITION_DONE)
+
+    try:
+        if before is not None:
+            before(batch_snapshot)
+        partitions = list(batch_snapshot.generate_query_batches(
+            sql, params=params, param_types=param_types))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for partition in partitions:
+                executor.submit(read_partition, partition)
+            try:
+                remaining = len(partitions)
+                while remaining:
+                    item = rows.get()
+                    if item is _PARTITION_DONE:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield from item
+            finally:
+                # Unblocks the readers if the consumer stops early or a partition failed
+                stop.set()
+    finally:
+        batch_snapshot.close()
+
+
+def stream_rows(database, sql, params=None, param_types=None, workers=None, before=None):
+    if workers and workers > 1:
+        return stream_partitioned_query(database, sql, params, param_types, workers, before)
+    return stream_query(database, sql, params, param_types, before)
+
+
+class ChunkWriter:
+    def __init__(self, flush_fn, chunk_size, new_buffer=list):
+        self.flush_fn = flush_fn
+        self.chunk_size = chunk_size
+        self.new_buffer = new_buffer
+        self.buffer = new_buffer()
+        # Keys buffered but not yet committed, so dedup can see them
+        self.pending_keys = set()
+        self.written = 0
+        self.flushes = 0
+
+    def add(self, key, item):
+        self.buffer.append(item)
+        self.pending_keys.add(key)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def write_all(self, keyed_items):
+        for key, item in keyed_items:
+            self.add(key, item)
+        self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.flush_fn(self.buffer)
+        self.written += len(self.buffer)
+        self.flushes += 1
+        self.buffer = self.new_buffer()
+        self.pending_keys = set()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
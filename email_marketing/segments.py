@@ -0,0 +1,258 @@
+import argparse
+import json
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from google.cloud import spanner
+
+from .connection import get_database
+from .email_marketing import Recipient
+from .logging_config import configure_logging
+from .metrics import COMMIT_SECONDS
+from .migrations import OPT_IN_INDEX, SOURCE_INDEX, UPDATED_AT_INDEX, migrate
+from .pipeline import chunked
+from .sync_state import get_watermarks, set_watermarks
+
+logger = logging.getLogger(__name__)
+
+
+# Named audience segments of email_marketing. A segment filters on
+# source_table, opt_in_status and a created_at range; its definition compiles
+# to a query on one of the segment indexes. Members are materialized in
+# segment_member, interleaved under the segment's row, so a campaign resolves
+# a segment of any size with one key-range read. refresh_segment keeps the
+# members current by re-evaluating only the email_marketing rows updated since
+# the last refresh, found through the updated_at index; the high-water mark is
+# kept in sync_state under "segment:<name>". Rows deleted from email_marketing
+# are only dropped by a full refresh. This relies on every writer to
+# email_marketing stamping updated_at with the commit timestamp; a row written
+# with an older updated_at is never seen by an incremental refresh.
+#
+#   python -m email_marketing.segments define recent-accounts --source-table account --created-after 2024-01-01
+#   python -m email_marketing.segments refresh recent-accounts
+
+DEFAULT_REFRESH_CHUNK_SIZE = 2000
+
+Segment = namedtuple('Segment', ['name', 'source_table', 'opted_in_only', 'created_after', 'created_before'])
+
+SEGMENT_COLUMNS = ('segment_name', 'source_table', 'opted_in_only', 'created_after', 'created_before', 'updated_at')
+MEMBER_COLUMNS = ('segment_name', 'email_marketing_id', 'email', 'first_name', 'added_at')
+
+
+def watermark_key(name):
+    return f"segment:{name}"
+
+
+def define_segment(database, segment):
+    with database.batch() as batch:
+        batch.insert_or_update(
+            table='segment',
+            columns=SEGMENT_COLUMNS,
+            values=[(segment.name, segment.source_table, segment.opted_in_only, segment.created_after,
+                     segment.created_before, spanner.COMMIT_TIMESTAMP)]
+        )
+        # A changed definition invalidates the cached members: the next refresh is full
+        batch.delete(table='sync_state', keyset=spanner.KeySet(keys=[[watermark_key(segment.name)]]))
+    logger.info("Segment %s defined.", segment.name)
+
+
+def get_segments(database, names=None):
+    with database.snapshot() as snapshot:
+        keyset = spanner.KeySet(keys=[[name] for name in names]) if names else spanner.KeySet(all_=True)
+        results = snapshot.read(table='segment', columns=SEGMENT_COLUMNS[:-1], keyset=keyset)
+        return [Segment(*row) for row in results]
+
+
+def get_segment(database, name):
+    segments = get_segments(database, [name])
+    if not segments:
+        raise KeyError(f"Unknown segment {name!r}")
+    return segments[0]
+
+
+def delete_segment(database, name):
+    # Members go with it through ON DELETE CASCADE
+    with database.batch() as batch:
+        batch.delete(table='segment', keyset=spanner.KeySet(keys=[[name]]))
+        batch.delete(table='sync_state', keyset=spanner.KeySet(keys=[[watermark_key(name)]]))
+    logger.info("Segment %s deleted.", name)
+
+
+# Compiles a segment to a query on the index whose key prefix covers its
+# filters: (source_table, opt_in_status, created_at) when it names a source,
+# (opt_in_status, created_at) otherwise. Both store email and first_name.
+
+
+def segment_query(segment):
+    conditions = []
+    params = {}
+    param_types = {}
+    if segment.source_table is not None:
+        index = SOURCE_INDEX
+        conditions.append("source_table = @source_table")
+        params["source_table"] = segment.source_table
+        param_types["source_table"] = spanner.param_types.STRING
+    else:
+        index = OPT_IN_INDEX
+    if segment.opted_in_only:
+        conditions.append("opt_in_status = TRUE")
+    if segment.created_after is not None:
+        conditions.append("created_at >= @created_after")
+        params["created_after"] = segment.created_after
+        param_types["created_after"] = spanner.param_types.TIMESTAMP
+    if segment.created_before is not None:
+        conditions.append("created_at < @created_before")
+        params["created_before"] = segment.created_before
+        param_types["created_before"] = spanner.param_types.TIMESTAMP
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT id, email, first_name FROM email_marketing@{{FORCE_INDEX={index}}}{where}"
+    return sql, params, param_types
+
+
+def is_member(segment, source_table, opt_in_status, created_at):
+    # The same filters as segment_query, for rows read by the incremental refresh
+    return ((segment.source_table is None or source_table == segment.source_table)
+            and (not segment.opted_in_only or opt_in_status)
+            and (segment.created_after is None or created_at >= segment.created_after)
+            and (segment.created_before is None or created_at < segment.created_before))
+
+
+def write_members(database, name, upserts, deletes=()):
+    with COMMIT_SECONDS.labels(table='segment_member').time():
+        with database.batch() as batch:
+            if upserts:
+                batch.insert_or_update(
+                    table='segment_member',
+                    columns=MEMBER_COLUMNS,
+                    values=[(name, id, email, first_name, spanner.COMMIT_TIMESTAMP)
+                            for id, email, first_name in upserts]
+                )
+            if deletes:
+                batch.delete(table='segment_member', keyset=spanner.KeySet(keys=[[name, id] for id in deletes]))
+
+
+def refresh_segment(database, name, full=False, chunk_size=DEFAULT_REFRESH_CHUNK_SIZE):
+    segment = get_segment(database, name)
+    watermark = None if full else get_watermarks(database).get(watermark_key(name))
+    stats = {"segment": name, "mode": "full" if watermark is None else "incremental",
+             "added": 0, "removed": 0, "scanned": 0}
+
+    # One snapshot for the whole refresh: the new watermark is the latest
+    # updated_at it can see, so later commits are picked up next time
+    with database.snapshot(multi_use=True) as snapshot:
+        if watermark is None:
+            results = snapshot.execute_sql(
+                f"SELECT MAX(updated_at) FROM email_marketing@{{FORCE_INDEX={UPDATED_AT_INDEX}}}")
+            new_watermark = list(results)[0][0]
+
+            with database.batch() as batch:
+                batch.delete(table='segment_member', keyset=spanner.KeySet(ranges=[
+                    spanner.KeyRange(start_closed=[name], end_closed=[name])
+                ]))
+            sql, params, param_types = segment_query(segment)
+            rows = snapshot.execute_sql(sql, params=params or None, param_types=param_types or None)
+            for chunk in chunked(rows, chunk_size):
+                write_members(database, name, chunk)
+                stats["scanned"] += len(chunk)
+                stats["added"] += len(chunk)
+        else:
+            new_watermark = watermark
+            rows = snapshot.execute_sql(
+                "SELECT id, email, first_name, source_table, opt_in_status, created_at, updated_at "
+                f"FROM email_marketing@{{FORCE_INDEX={UPDATED_AT_INDEX}}} WHERE updated_at > @watermark",
+                params={"watermark": watermark},
+                param_types={"watermark": spanner.param_types.TIMESTAMP}
+            )
+            for chunk in chunked(rows, chunk_size):
+                upserts = []
+                deletes = []
+                for id, email, first_name, source_table, opt_in_status, created_at, updated_at in chunk:
+                    new_watermark = max(new_watermark, updated_at)
+                    if is_member(segment, source_table, opt_in_status, created_at):
+                        upserts.append((id, email, first_name))
+                    else:
+                        deletes.append(id)
+                write_members(database, name, upserts, deletes)
+                stats["scanned"] += len(chunk)
+                stats["added"] += len(upserts)
+                stats["removed"] += len(deletes)
+
+    if new_watermark is not None:
+        set_watermarks(database, {watermark_key(name): new_watermark})
+    logger.info("Segment %s refreshed: %s", name, stats)
+    return stats
+
+
+def refresh_segments(database, full=False):
+    return [refresh_segment(database, segment.name, full) for segment in get_segments(database)]
+
+
+# A single key-range read over the segment's prefix of segment_member, in id order
+
+
+def iter_segment_members(database, name):
+    with database.snapshot() as snapshot:
+        results = snapshot.read(
+            table='segment_member',
+            columns=('email_marketing_id', 'email', 'first_name'),
+            keyset=spanner.KeySet(ranges=[
+                spanner.KeyRange(start_closed=[name], end_closed=[name])
+            ])
+        )
+        for row in results:
+            yield Recipient(*row)
+
+
+def count_members(database, name):
+    with database.snapshot() as snapshot:
+        results = snapshot.execute_sql(
+            "SELECT COUNT(*) FROM segment_member WHERE segment_name = @name",
+            params={"name": name}, param_types={"name": spanner.param_types.STRING})
+        return list(results)[0][0]
+
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Define and refresh email_marketing segments.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    define_parser = subparsers.add_parser("define")
+    define_parser.add_argument("name")
+    define_parser.add_argument("--source-table")
+    define_parser.add_argument("--include-opted-out", action="store_true")
+    define_parser.add_argument("--created-after", type=parse_timestamp)
+    define_parser.add_argument("--created-before", type=parse_timestamp)
+
+    refresh_parser = subparsers.add_parser("refresh")
+    refresh_parser.add_argument("name", nargs="?", help="defaults to every segment")
+    refresh_parser.add_argument("--full", action="store_true")
+
+    delete_parser = subparsers.add_parser("delete")
+    delete_parser.add_argument("name")
+
+    subparsers.add_parser("list")
+    args = parser.parse_args()
+
+    configure_logging()
+    database = get_database()
+    migrate(database)
+
+    if args.command == "define":
+        define_segment(database, Segment(args.name, args.source_table, not args.include_opted_out,
+                                         args.created_after, args.created_before))
+        print(json.dumps(refresh_segment(database, args.name)))
+    elif args.command == "refresh":
+        results = [refresh_segment(database, args.name, args.full)] if args.name else refresh_segments(
+            database, args.full)
+        for result in results:
+            print(json.dumps(result))
+    elif args.command == "delete":
+        delete_segment(database, args.name)
+    else:
+        for segment in get_segments(database):
+            print(json.dumps(dict(segment._asdict(), members=count_members(database, segment.name)), default=str))
@@ -0,0 +1,242 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import spanner
+
+from .connection import get_database
+from .email_marketing import DEFAULT_CHUNK_SIZE, DEFAULT_WATERMARK_LOOKBACK, update_email_marketing
+from .logging_config import configure_logging
+from .migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+
+# Multi-worker email_marketing sync. The normalized email keyspace is split into
+# num_shards hash shards; workers claim shards of a run through leases in the
+# sync_lease table, renew them with a heartbeat while syncing, and mark them
+# completed. A shard whose lease expires (dead worker) is claimed again by
+# whoever asks next. All lease times use Spanner's clock, not the workers'.
+#
+#   python -m email_marketing.shards launch --processes 4 --num-shards 16
+#   python -m email_marketing.shards status
+
+DEFAULT_NUM_SHARDS = 16
+DEFAULT_LEASE_SECONDS = 60
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def default_run_id():
+    # One run per day, matching the daily scheduler
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claim_shard(database, run_id, num_shards, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+    params = {"run_id": run_id}
+    param_types = {"run_id": spanner.param_types.STRING}
+
+    def claim(transaction):
+        # The first worker of a run creates its shard rows
+        results = transaction.execute_sql(
+            "SELECT COUNT(*) FROM sync_lease WHERE run_id = @run_id", params=params, param_types=param_types)
+        if list(results)[0][0] == 0:
+            transaction.execute_update(
+                "INSERT INTO sync_lease (run_id, shard_id, num_shards) "
+                "SELECT @run_id, shard_id, @num_shards FROM UNNEST(GENERATE_ARRAY(0, @num_shards - 1)) AS shard_id",
+                params={"run_id": run_id, "num_shards": num_shards},
+                param_types={"run_id": spanner.param_types.STRING, "num_shards": spanner.param_types.INT64})
+
+        results = transaction.execute_sql(
+            "SELECT shard_id, num_shards FROM sync_lease WHERE run_id = @run_id AND completed_at IS NULL "
+            "AND (expires_at IS NULL OR expires_at < CURRENT_TIMESTAMP()) ORDER BY shard_id LIMIT 1",
+            params=params, param_types=param_types)
+        rows = list(results)
+        if not rows:
+            return None
+
+        shard_id, run_num_shards = rows[0]
+        transaction.execute_update(
+            "UPDATE sync_lease SET owner = @owner, heartbeat_at = CURRENT_TIMESTAMP(), "
+            "expires_at = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @lease_seconds SECOND) "
+            "WHERE run_id = @run_id AND shard_id = @shard_id",
+            params={"owner": owner, "lease_seconds": lease_seconds, "run_id": run_id, "shard_id": shard_id},
+            param_types={"owner": spanner.param_types.STRING, "lease_seconds": spanner.param_types.INT64,
+                         "run_id": spanner.param_types.STRING, "shard_id": spanner.param_types.INT64})
+        return shard_id, run_num_shards
+
+    return database.run_in_transaction(claim)
+
+
+def _update_lease(database, sql, run_id, shard_id, owner, extra_params=None, extra_types=None):
+    params = {"run_id": run_id, "shard_id": shard_id, "owner": owner}
+    param_types = {"run_id": spanner.param_types.STRING, "shard_id": spanner.param_types.INT64,
+                   "owner": spanner.param_types.STRING}
+    params.update(extra_params or {})
+    param_types.update(extra_types or {})
+
+    # Only the current owner may touch the lease
+    return database.run_in_transaction(lambda transaction: transaction.execute_update(
+        sql + " WHERE run_id = @run_id AND shard_id = @shard_id AND owner = @owner",
+        params=params, param_types=param_types))
+
+
+def renew_lease(database, run_id, shard_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+    updated = _update_lease(
+        database,
+        "UPDATE sync_lease SET heartbeat_at = CURRENT_TIMESTAMP(), "
+        "expires_at = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @lease_seconds SECOND)",
+        run_id, shard_id, owner, {"lease_seconds": lease_seconds}, {"lease_seconds": spanner.param_types.INT64})
+    return updated == 1
+
+
+def complete_shard(database, run_id, shard_id, owner, result):
+    updated = _update_lease(
+        database,
+        "UPDATE sync_lease SET completed_at = CURRENT_TIMESTAMP(), result = @result",
+        run_id, shard_id, owner, {"result": json.dumps(result, default=str)}, {"result": spanner.param_types.STRING})
+    return updated == 1
+
+
+def release_shard(database, run_id, shard_id, owner):
+    # Expire the lease now so another worker can retry the shard right away
+    _update_lease(
+        database, "UPDATE sync_lease SET expires_at = CURRENT_TIMESTAMP()", run_id, shard_id, owner)
+
+
+class Heartbeat:
+    def __init__(self, database, run_id, shard_id, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.database = database
+        self.run_id = run_id
+        self.shard_id = shard_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"lease-{shard_id}", daemon=True)
+
+    def _run(self):
+        # Renew well before expiry so one slow round trip does not lose the lease
+        while not self.stopped.wait(self.lease_seconds / 3):
+            try:
+                if not renew_lease(self.database, self.run_id, self.shard_id, self.owner, self.lease_seconds):
+                    logger.warning("Lease on shard %d was taken over.", self.shard_id)
+                    self.lost.set()
+                    return
+            except Exception:
+                logger.exception("Heartbeat for shard %d failed.", self.shard_id)
+
+    def check(self, *args):
+        # Used as the sync's progress callback: stops the sync once the lease is gone
+        if self.lost.is_set():
+            raise LeaseLost(f"Lease on shard {self.shard_id} lost")
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+
+
+def run_worker(database, run_id, num_shards=DEFAULT_NUM_SHARDS, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+               full=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, lookback=DEFAULT_WATERMARK_LOOKBACK):
+    owner = owner or default_owner()
+    completed = []
+    while True:
+        # The run's shard count wins over ours if the run was started with another one
+        shard = claim_shard(database, run_id, num_shards, owner, lease_seconds)
+        if shard is None:
+            break
+
+        logger.info("Worker %s claimed shard %d/%d of run %s.", owner, shard[0], shard[1], run_id)
+        try:
+            with Heartbeat(database, run_id, shard[0], owner, lease_seconds) as heartbeat:
+                result = update_email_marketing(
+                    database, full=full, chunk_size=chunk_size, workers=workers,
+                    on_progress=heartbeat.check, shard=shard, lookback=lookback)
+        except LeaseLost:
+            logger.warning("Worker %s gave up shard %d after losing its lease.", owner, shard[0])
+            continue
+        except Exception:
+            release_shard(database, run_id, shard[0], owner)
+            raise
+
+        if complete_shard(database, run_id, shard[0], owner, result):
+            completed.append(shard[0])
+        else:
+            logger.warning("Worker %s lost shard %d before completing it.", owner, shard[0])
+
+    logger.info("Worker %s finished run %s after %d shards.", owner, run_id, len(completed))
+    return completed
+
+
+def get_status(database, run_id):
+    with database.snapshot() as snapshot:
+        results = snapshot.execute_sql(
+            "SELECT shard_id, num_shards, owner, expires_at, heartbeat_at, completed_at, result "
+            "FROM sync_lease WHERE run_id = @run_id ORDER BY shard_id",
+            params={"run_id": run_id}, param_types={"run_id": spanner.param_types.STRING})
+        return [
+            dict(zip(("shard_id", "num_shards", "owner", "expires_at", "heartbeat_at", "completed_at", "result"), row))
+            for row in results
+        ]
+
+
+def launch(processes, worker_args):
+    # Starts several local worker processes, e.g. against the emulator
+    children = [
+        subprocess.Popen([sys.executable, "-m", "email_marketing.shards", "worker"] + worker_args)
+        for _ in range(processes)
+    ]
+    return [child.wait() for child in children]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sharded email_marketing sync workers.")
+    parser.add_argument("command", choices=["worker", "launch", "status"])
+    parser.add_argument("--run-id", default=default_run_id())
+    parser.add_argument("--num-shards", type=int, default=DEFAULT_NUM_SHARDS)
+    parser.add_argument("--lease-seconds", type=int, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument("--processes", type=int, default=2, help="worker processes started by launch")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, help="partitioned read threads per worker")
+    parser.add_argument("--full", action="store_true")
+    parser.add_argument("--lookback-seconds", type=int, default=int(DEFAULT_WATERMARK_LOOKBACK.total_seconds()),
+                        help="how far before the user_feedback watermark to re-read")
+    args = parser.parse_args()
+
+    configure_logging()
+    database = get_database()
+
+    if args.command == "launch":
+        migrate(database)
+        worker_args = ["--run-id", args.run_id, "--num-shards", str(args.num_shards),
+                       "--lease-seconds", str(args.lease_seconds), "--chunk-size", str(args.chunk_size),
+                       "--lookback-seconds", str(args.lookback_seconds)]
+        if args.workers:
+            worker_args += ["--workers", str(args.workers)]
+        if args.full:
+            worker_args.append("--full")
+        exit_codes = launch(args.processes, worker_args)
+        sys.exit(max(exit_codes, default=0))
+    elif args.command == "worker":
+        run_worker(database, args.run_id, args.num_shards, lease_seconds=args.lease_seconds, full=args.full,
+                   chunk_size=args.chunk_size, workers=args.workers, lookback=timedelta(seconds=args.lookback_seconds))
+    else:
+        for row in get_status(database, args.run_id):
+            print(json.dumps(row, default=str))
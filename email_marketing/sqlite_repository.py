@@ -0,0 +1,248 @@
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from google.cloud import spanner
+
+from .account import Account
+from .email_marketing import (EXISTING_EMAILS_BATCH_SIZE, SOURCE_QUERIES, EmailMarketing, Recipient, Repository,
+                              normalize_email)
+from .fingerprint_index import fingerprint
+from .user_feedback import UserFeedback
+
+logger = logging.getLogger(__name__)
+
+
+# Local Repository on SQLite, in memory by default, for running the sync, the
+# sender's recipient reads and the benchmarks without the Spanner emulator.
+# Tables mirror the Spanner schema, including the unique index on the
+# normalized email, so duplicate inserts fail here too. Timestamps are stored
+# as fixed-width UTC ISO strings, which sort like the times they stand for.
+# Partitioned reads are Spanner-only; workers is ignored.
+#
+#   repository = SqliteRepository()
+#   load_synthetic_data(repository, accounts=100000, user_feedback=100000)
+#   update_email_marketing(repository)
+
+SCAN_BATCH_SIZE = 1000
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS account (
+        id TEXT NOT NULL PRIMARY KEY,
+        email TEXT NOT NULL,
+        auth_type TEXT NOT NULL,
+        password TEXT NOT NULL,
+        account_name TEXT,
+        status TEXT NOT NULL,
+        more_info TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        created_by TEXT NOT NULL,
+        updated_by TEXT NOT NULL,
+        version INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_feedback (
+        id TEXT NOT NULL PRIMARY KEY,
+        feedback_type TEXT NOT NULL,
+        creation_time TEXT NOT NULL,
+        username TEXT NOT NULL,
+        email TEXT NOT NULL,
+        full_name TEXT NOT NULL,
+        content TEXT NOT NULL,
+        user_ip TEXT NOT NULL,
+        user_agent TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS email_marketing (
+        id TEXT NOT NULL PRIMARY KEY,
+        email TEXT NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        source_table TEXT NOT NULL,
+        source_id TEXT NOT NULL,
+        opt_in_status INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        email_normalized TEXT NOT NULL
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS email_marketing_email_normalized ON email_marketing (email_normalized)",
+    "CREATE INDEX IF NOT EXISTS user_feedback_creation_time ON user_feedback (creation_time)",
+    "CREATE INDEX IF NOT EXISTS account_updated_at ON account (updated_at)",
+    """
+    CREATE TABLE IF NOT EXISTS sync_state (
+        source TEXT NOT NULL PRIMARY KEY,
+        watermark TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+]
+
+TIMESTAMP_COLUMNS = {
+    'account': ('created_at', 'updated_at'),
+    'user_feedback': ('creation_time',),
+    'email_marketing': ('created_at', 'updated_at'),
+}
+
+
+def to_timestamp(value, now=None):
+    if value is None:
+        return None
+    if value == spanner.COMMIT_TIMESTAMP:
+        value = now or datetime.now(timezone.utc)
+    elif isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def from_timestamp(value):
+    return datetime.fromisoformat(value[:-1] + '+00:00') if value is not None else None
+
+
+def shard_of(email, num_shards):
+    # Stands in for Spanner's FARM_FINGERPRINT shard filter; consistent within this backend only
+    return fingerprint(normalize_email(email)) % num_shards
+
+
+class SqliteRepository(Repository):
+    def __init__(self, path=':memory:'):
+        # One connection shared by the sync and the sender's prefetch thread
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.create_function('normalize_email', 1, normalize_email, deterministic=True)
+        self.connection.create_function('shard_of', 2, shard_of, deterministic=True)
+        self.lock = threading.RLock()
+
+    def close(self):
+        self.connection.close()
+
+    def create_tables(self):
+        with self.lock, self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def clear_tables(self, tables):
+        with self.lock, self.connection:
+            for table in tables:
+                self.connection.execute(f"DELETE FROM {table}")
+
+    def _insert(self, table, columns, rows):
+        # Commit timestamps and datetimes become stored timestamp strings
+        now = datetime.now(timezone.utc)
+        positions = [columns.index(name) for name in TIMESTAMP_COLUMNS.get(table, ())]
+        values = []
+        for row in rows:
+            row = list(row)
+            for position in positions:
+                row[position] = to_timestamp(row[position], now)
+            values.append(row)
+
+        placeholders = ', '.join('?' for _ in columns)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", values)
+
+    def scan_source(self, source_table, watermark=None, unseen_only=True, workers=None, shard=None,
+                    on_watermark=None):
+        select, timestamp_column, _ = SOURCE_QUERIES[source_table]
+        conditions = ["src.email IS NOT NULL"]
+        params = []
+        if shard is not None:
+            conditions.append("shard_of(src.email, ?) = ?")
+            params += [shard[1], shard[0]]
+        if watermark is not None:
+            conditions.append(f"src.{timestamp_column} > ?")
+            params.append(to_timestamp(watermark))
+        range_filter = ' AND '.join(conditions)
+        if unseen_only:
+            conditions.append("NOT EXISTS (SELECT 1 FROM email_marketing AS em "
+                              "WHERE em.email_normalized = normalize_email(src.email))")
+        sql = f"{select} FROM {source_table} AS src WHERE {' AND '.join(conditions)}"
+
+        if on_watermark is not None:
+            # Latest timestamp of the range before the anti-join, as on Spanner
+            with self.lock:
+                latest = self.connection.execute(
+                    f"SELECT MAX(src.{timestamp_column}) FROM {source_table} AS src WHERE {range_filter}",
+                    params).fetchone()[0]
+            on_watermark(from_timestamp(latest))
+
+        # Fetched in batches so a scan of millions of rows stays bounded
+        with self.lock:
+            cursor = self.connection.execute(sql, params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(SCAN_BATCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield row[0], row[1], row[2], from_timestamp(row[3])
+
+    def existing_emails(self, normalized_emails):
+        existing_emails = set()
+        normalized_emails = list(normalized_emails)
+        with self.lock:
+            for start in range(0, len(normalized_emails), EXISTING_EMAILS_BATCH_SIZE):
+                batch = normalized_emails[start:start + EXISTING_EMAILS_BATCH_SIZE]
+                results = self.connection.execute(
+                    f"SELECT email_normalized FROM email_marketing WHERE email_normalized IN "
+                    f"({', '.join('?' for _ in batch)})", batch)
+                existing_emails.update(row[0] for row in results)
+        return existing_emails
+
+    def normalized_emails(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT email_normalized FROM email_marketing")]
+
+    def insert_email_marketing(self, rows):
+        email_position = EmailMarketing.COLUMNS.index('email')
+        self._insert(
+            'email_marketing', EmailMarketing.COLUMNS + ('email_normalized',),
+            (tuple(row) + (normalize_email(row[email_position]),) for row in rows))
+
+    def recipient_page(self, last_id, page_size, opted_in_only=True, source_table=None, created_after=None):
+        conditions = []
+        params = []
+        if last_id is not None:
+            conditions.append("id > ?")
+            params.append(last_id)
+        if opted_in_only:
+            conditions.append("opt_in_status = 1")
+        if source_table is not None:
+            conditions.append("source_table = ?")
+            params.append(source_table)
+        if created_after is not None:
+            conditions.append("created_at > ?")
+            params.append(to_timestamp(created_after))
+
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        with self.lock:
+            results = self.connection.execute(
+                f"SELECT id, email, first_name FROM email_marketing {where}ORDER BY id LIMIT ?", params + [page_size])
+            return [Recipient(*row) for row in results]
+
+    def get_watermarks(self):
+        with self.lock:
+            results = self.connection.execute("SELECT source, watermark FROM sync_state")
+            return {row[0]: from_timestamp(row[1]) for row in results}
+
+    def set_watermarks(self, watermarks):
+        if not watermarks:
+            return
+        now = to_timestamp(spanner.COMMIT_TIMESTAMP)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO sync_state (source, watermark, updated_at) VALUES (?, ?, ?)",
+                [(source, to_timestamp(watermark), now) for source, watermark in watermarks.items()])
+
+    def insert_accounts(self, accounts):
+        self._insert('account', Account.COLUMNS, (account.to_row() for account in accounts))
+
+    def insert_user_feedback(self, feedback_list):
+        self._insert('user_feedback', UserFeedback.COLUMNS, (feedback.to_row() for feedback in feedback_list))
@@ -0,0 +1,38 @@
+import logging
+from google.cloud import spanner
+
+logger = logging.getLogger(__name__)
+
+
+# Per-source high-water marks used by the incremental email_marketing sync
+
+
+def get_watermarks(database):
+    with database.snapshot() as snapshot:
+        results = snapshot.execute_sql("SELECT source, watermark FROM sync_state")
+        return {row[0]: row[1] for row in results}
+
+
+def set_watermarks(database, watermarks):
+    if not watermarks:
+        return
+
+    with database.batch() as batch:
+        batch.insert_or_update(
+            table='sync_state',
+            columns=('source', 'watermark', 'updated_at'),
+            values=[
+                (source, watermark, spanner.COMMIT_TIMESTAMP)
+                for source, watermark in watermarks.items()
+            ]
+        )
+    logger.info("Watermarks updated for %s.", ", ".join(sorted(watermarks)))
+
+
+def reset_watermarks(database):
+    with database.batch() as batch:
+        batch.delete(
+            table='sync_state',
+            keyset=spanner.KeySet(all_=True)
+        )
+    logger.info("SyncState table emptied successfully.")
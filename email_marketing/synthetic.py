@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from .account import Account
+from .connection import get_database
+from .email_marketing import as_repository
+from .logging_config import configure_logging
+from .pipeline import chunked
+from .user_feedback import UserFeedback
+
+logger = logging.getLogger(__name__)
+
+
+# Seeded synthetic account and user_feedback rows at realistic volumes, for
+# load tests and benchmarks of the email_marketing sync:
+#
+#   python -m email_marketing.synthetic --accounts 500000 --user-feedback 500000 --duplicate-ratio 0.2
+#
+# The same seed always produces the same rows. A share of the rows reuse an
+# email from an earlier row of either table, with different case or padding,
+# the way real signups and feedback overlap. Emails are derived from a row
+# number rather than kept in memory, so generating millions of rows runs in
+# constant memory.
+
+DEFAULT_SEED = 42
+DEFAULT_DUPLICATE_RATIO = 0.2
+DEFAULT_NULL_NAME_RATIO = 0.1
+DEFAULT_SINGLE_NAME_RATIO = 0.1
+DEFAULT_LOAD_CHUNK_SIZE = 2000
+DEFAULT_HISTORY_DAYS = 365
+
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William',
+               'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Carlos', 'Maria', 'Wei', 'Yuki', 'Aisha', 'Mohammed', 'Olga', 'Priya', 'Liam', 'Emma')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Taylor', 'Thomas', 'Moore', 'Jackson',
+              'Chen', 'Wang', 'Tanaka', 'Khan', 'Ivanova', 'Patel', 'Murphy', "O'Brien", 'de la Cruz')
+DOMAINS = ('gmail.com', 'yahoo.com', 'outlook.com', 'hotmail.com', 'icloud.com', 'example.com', 'company.io')
+FEEDBACK_TYPES = ('bug', 'feature', 'question', 'praise', 'complaint')
+USER_AGENTS = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64)', 'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0)',
+               'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)', 'Mozilla/5.0 (X11; Linux x86_64)')
+
+
+class SyntheticGenerator:
+    def __init__(self, seed=DEFAULT_SEED, duplicate_ratio=DEFAULT_DUPLICATE_RATIO,
+                 null_name_ratio=DEFAULT_NULL_NAME_RATIO, single_name_ratio=DEFAULT_SINGLE_NAME_RATIO,
+                 history_days=DEFAULT_HISTORY_DAYS, now=None):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.duplicate_ratio = duplicate_ratio
+        self.null_name_ratio = null_name_ratio
+        self.single_name_ratio = single_name_ratio
+        self.history_days = history_days
+        self.now = now or datetime(2024, 9, 1, tzinfo=timezone.utc)
+        # Number of distinct emails handed out so far, across both tables
+        self.people = 0
+
+    def person(self, number):
+        # Name and email of the number-th distinct person, the same on every call
+        digest = hashlib.blake2b(f"{self.seed}:{number}".encode(), digest_size=8).digest()
+        first = FIRST_NAMES[digest[0] % len(FIRST_NAMES)]
+        last = LAST_NAMES[digest[1] % len(LAST_NAMES)]
+        domain = DOMAINS[digest[2] % len(DOMAINS)]
+        local = f"{first}.{last}".replace(' ', '').replace("'", '').lower()
+        return first, last, f"{local}{number}@{domain}"
+
+    def next_person(self):
+        if self.people and self.random.random() < self.duplicate_ratio:
+            first, last, email = self.person(self.random.randrange(self.people))
+            # Duplicates differ from the original the way hand-typed emails do
+            variant = self.random.random()
+            if variant < 0.3:
+                email = email.upper()
+            elif variant < 0.5:
+                email = f" {email.capitalize()} "
+            return first, last, email
+
+        self.people += 1
+        return self.person(self.people - 1)
+
+    def name(self, first, last):
+        draw = self.random.random()
+        if draw < self.null_name_ratio:
+            return None
+        if draw < self.null_name_ratio + self.single_name_ratio:
+            return first
+        return f"{first} {last}"
+
+    def accounts(self, count, start_id=0):
+        for i in range(start_id, start_id + count):
+            first, last, email = self.next_person()
+            yield Account(
+                str(i), email, self.random.choice(('password', 'google', 'apple')), f"hash-{i}",
+                self.name(first, last), self.random.choice(('active', 'active', 'active', 'disabled')),
+                json.dumps({"plan": self.random.choice(('free', 'pro', 'team'))}), 'synthetic', 'synthetic', 1
+            )
+
+    def user_feedback(self, count, start_id=0):
+        history = self.history_days * 86400
+        for i in range(start_id, start_id + count):
+            first, last, email = self.next_person()
+            # full_name is NOT NULL in user_feedback, so a missing name is empty
+            full_name = self.name(first, last) or ''
+            yield UserFeedback(
+                id=str(i),
+                feedback_type=self.random.choice(FEEDBACK_TYPES),
+                creation_time=self.now - timedelta(seconds=self.random.randrange(history)),
+                username=f"{first.lower()}{i}",
+                email=email,
+                full_name=full_name,
+                content=f"Synthetic feedback {i}",
+                user_ip=f"10.{self.random.randrange(256)}.{self.random.randrange(256)}.{self.random.randrange(256)}",
+                user_agent=self.random.choice(USER_AGENTS)
+            )
+
+
+# Inserts in chunks so memory and commit size stay bounded at any row count.
+# database is a Spanner database or any Repository.
+
+
+def load_synthetic_data(database, accounts=0, user_feedback=0, seed=DEFAULT_SEED,
+                        duplicate_ratio=DEFAULT_DUPLICATE_RATIO, null_name_ratio=DEFAULT_NULL_NAME_RATIO,
+                        chunk_size=DEFAULT_LOAD_CHUNK_SIZE):
+    repository = as_repository(database)
+    repository.create_tables()
+    generator = SyntheticGenerator(seed, duplicate_ratio, null_name_ratio)
+    started = time.monotonic()
+
+    for chunk in chunked(generator.accounts(accounts), chunk_size):
+        repository.insert_accounts(chunk)
+    for chunk in chunked(generator.user_feedback(user_feedback), chunk_size):
+        repository.insert_user_feedback(chunk)
+
+    elapsed = time.monotonic() - started
+    logger.info("Loaded %d accounts and %d user_feedback rows (%d distinct emails) in %.1fs.",
+                accounts, user_feedback, generator.people, elapsed)
+    return {"accounts": accounts, "user_feedback": user_feedback, "distinct_emails": generator.people,
+            "seconds": round(elapsed, 3)}
+
+
+def clear_tables(database, tables=('account', 'user_feedback', 'email_marketing', 'sync_state')):
+    as_repository(database).clear_tables(tables)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load seeded synthetic account and user_feedback rows.")
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--user-feedback", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--duplicate-ratio", type=float, default=DEFAULT_DUPLICATE_RATIO)
+    parser.add_argument("--null-name-ratio", type=float, default=DEFAULT_NULL_NAME_RATIO)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_LOAD_CHUNK_SIZE)
+    parser.add_argument("--clear", action="store_true", help="empty the source and email_marketing tables first")
+    args = parser.parse_args()
+
+    configure_logging()
+    database = get_database()
+    if args.clear:
+        clear_tables(database)
+    print(json.dumps(load_synthetic_data(
+        database, args.accounts, args.user_feedback, args.seed, args.duplicate_ratio, args.null_name_ratio,
+        args.chunk_size)))
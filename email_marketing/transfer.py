@@ -0,0 +1,295 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from google.cloud import spanner
+
+from .bulk_writer import write_rows
+from .columnar import ColumnBatch
+from .connection import get_database
+from .email_marketing import EMAIL_MARKETING_EXTRA_MUTATIONS, EmailMarketing
+from .logging_config import configure_logging
+from .pipeline import chunked
+
+logger = logging.getLogger(__name__)
+
+
+# Bulk export and import of email_marketing, for backfills and audits:
+#
+#   python -m email_marketing.transfer export audience.parquet
+#   python -m email_marketing.transfer import audience.parquet --workers 4
+#
+# Exports page through the table by primary key inside one read-only snapshot
+# and write every page out before reading the next, as one Parquet row group
+# or a run of CSV lines. Imports read the file in chunks and commit them on a
+# few threads with insert_or_update, so replaying a chunk is harmless; the
+# number of rows committed so far is kept in an offsets file and a rerun
+# resumes from there. Parquet support needs pyarrow.
+
+DEFAULT_EXPORT_PAGE_SIZE = 10000
+DEFAULT_IMPORT_CHUNK_SIZE = 2000
+DEFAULT_IMPORT_WORKERS = 4
+
+REQUIRED_COLUMNS = ('id', 'email', 'source_table', 'source_id')
+
+
+def file_format(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in ('csv', 'parquet'):
+        raise ValueError(f"Unsupported format {fmt!r}, expected csv or parquet")
+    return fmt
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export and import need pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def parquet_schema(pa):
+    return pa.schema([
+        ('id', pa.string()),
+        ('email', pa.string()),
+        ('first_name', pa.string()),
+        ('last_name', pa.string()),
+        ('source_table', pa.string()),
+        ('source_id', pa.string()),
+        ('opt_in_status', pa.bool_()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('updated_at', pa.timestamp('us', tz='UTC')),
+    ])
+
+
+# Export
+
+
+def iter_entry_pages(snapshot, page_size, opted_in_only=False):
+    last_id = None
+    while True:
+        conditions = ["opt_in_status = TRUE"] if opted_in_only else []
+        params = {"page_size": page_size}
+        param_types = {"page_size": spanner.param_types.INT64}
+        if last_id is not None:
+            conditions.append("id > @last_id")
+            params["last_id"] = last_id
+            param_types["last_id"] = spanner.param_types.STRING
+
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        sql = f"SELECT {', '.join(EmailMarketing.COLUMNS)} FROM email_marketing {where}ORDER BY id LIMIT @page_size"
+        page = ColumnBatch(EmailMarketing.COLUMNS, snapshot.execute_sql(sql, params=params, param_types=param_types))
+        if len(page):
+            yield page
+        if len(page) < page_size:
+            return
+        last_id = page.column('id')[-1]
+
+
+class CsvExportWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(EmailMarketing.COLUMNS)
+
+    def write(self, page):
+        self.writer.writerows(
+            [value.isoformat() if isinstance(value, datetime) else value for value in row]
+            for row in page.rows()
+        )
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    def __init__(self, path):
+        self.pa = import_pyarrow()
+        self.schema = parquet_schema(self.pa)
+        self.writer = self.pa.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, page):
+        # One row group per page
+        table = self.pa.table({name: page.column(name) for name in EmailMarketing.COLUMNS}, schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    'csv': CsvExportWriter,
+    'parquet': ParquetExportWriter
+}
+
+
+def export_entries(database, path, fmt=None, page_size=DEFAULT_EXPORT_PAGE_SIZE, opted_in_only=False):
+    started = time.monotonic()
+    writer = EXPORT_WRITERS[file_format(path, fmt)](path)
+    exported = 0
+    try:
+        # A single snapshot makes the export consistent as of its start
+        with database.snapshot(multi_use=True) as snapshot:
+            for page in iter_entry_pages(snapshot, page_size, opted_in_only):
+                writer.write(page)
+                exported += len(page)
+                logger.debug("Exported %d rows.", exported)
+    finally:
+        writer.close()
+
+    elapsed = time.monotonic() - started
+    logger.info("Exported %d email_marketing rows to %s in %.1fs.", exported, path, elapsed)
+    return {"rows": exported, "seconds": round(elapsed, 3)}
+
+
+# Import
+
+
+def read_csv_rows(path):
+    with open(path, newline='', encoding='utf-8') as file:
+        yield from csv.DictReader(file)
+
+
+def read_parquet_rows(path, batch_size):
+    pa = import_pyarrow()
+    parquet_file = pa.parquet.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def to_import_row(record):
+    missing = [name for name in REQUIRED_COLUMNS if not record.get(name)]
+    if missing:
+        raise ValueError(f"Row {record!r} is missing {', '.join(missing)}")
+
+    opt_in_status = record.get('opt_in_status', True)
+    if isinstance(opt_in_status, str):
+        opt_in_status = opt_in_status.strip().lower() in ('1', 'true', 'yes')
+
+    row = {name: record.get(name) or None for name in EmailMarketing.COLUMNS}
+    row['opt_in_status'] = bool(opt_in_status)
+    # The file's created_at is kept, or the commit time for rows without one.
+    # updated_at is always the commit time: segment refreshes only pick up rows
+    # updated after their watermark, and a historical value would hide the row.
+    created_at = row['created_at']
+    if created_at is None:
+        row['created_at'] = spanner.COMMIT_TIMESTAMP
+    elif isinstance(created_at, str):
+        row['created_at'] = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+    row['updated_at'] = spanner.COMMIT_TIMESTAMP
+    return tuple(row[name] for name in EmailMarketing.COLUMNS)
+
+
+def commit_chunk(database, rows):
+    # Chunks already run in parallel, so each is written on the calling thread
+    write_rows(database, 'email_marketing', EmailMarketing.COLUMNS, rows, mode='insert_or_update', workers=1,
+               mutations_per_row=len(EmailMarketing.COLUMNS) + EMAIL_MARKETING_EXTRA_MUTATIONS)
+    return len(rows)
+
+
+def load_offset(offsets_path, path):
+    if not os.path.exists(offsets_path):
+        return 0
+    with open(offsets_path) as file:
+        state = json.load(file)
+    if state.get('source') != os.path.abspath(path):
+        raise ValueError(f"{offsets_path} belongs to {state.get('source')}, not {path}")
+    return state['offset']
+
+
+def save_offset(offsets_path, path, offset):
+    # Replaced atomically so a crash never leaves a torn offsets file
+    tmp_path = offsets_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({"source": os.path.abspath(path), "offset": offset}, file)
+    os.replace(tmp_path, offsets_path)
+
+
+def import_entries(database, path, fmt=None, chunk_size=DEFAULT_IMPORT_CHUNK_SIZE, workers=DEFAULT_IMPORT_WORKERS,
+                   offsets_path=None, restart=False):
+    fmt = file_format(path, fmt)
+    offsets_path = offsets_path or path + '.offsets.json'
+    if restart and os.path.exists(offsets_path):
+        os.remove(offsets_path)
+    offset = load_offset(offsets_path, path)
+    if offset:
+        logger.info("Resuming import of %s after %d rows.", path, offset)
+
+    started = time.monotonic()
+    records = read_parquet_rows(path, chunk_size) if fmt == 'parquet' else read_csv_rows(path)
+    imported = 0
+    skipped = 0
+    pending = deque()
+
+    # Chunks are collected in submission order, so the saved offset only ever
+    # covers rows whose chunk and every chunk before it have been committed
+    def collect():
+        nonlocal offset, imported
+        end, future = pending.popleft()
+        imported += future.result()
+        offset = end
+        save_offset(offsets_path, path, offset)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        position = 0
+        for chunk in chunked(records, chunk_size):
+            start = position
+            position += len(chunk)
+            if position <= offset:
+                skipped += len(chunk)
+                continue
+            if start < offset:
+                # The saved offset falls inside this chunk when --chunk-size changed
+                skipped += offset - start
+                chunk = chunk[offset - start:]
+            rows = [to_import_row(record) for record in chunk]
+            if len(pending) >= workers:
+                collect()
+            pending.append((position, executor.submit(commit_chunk, database, rows)))
+        while pending:
+            collect()
+
+    # Done: a later run of the same file starts over
+    if os.path.exists(offsets_path):
+        os.remove(offsets_path)
+
+    elapsed = time.monotonic() - started
+    logger.info("Imported %d rows from %s in %.1fs (%d already imported).", imported, path, elapsed, skipped)
+    return {"rows": imported, "resumed_after": skipped, "seconds": round(elapsed, 3)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export or import email_marketing as Parquet or CSV.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=["csv", "parquet"], help="defaults to the file extension")
+    export_parser.add_argument("--page-size", type=int, default=DEFAULT_EXPORT_PAGE_SIZE)
+    export_parser.add_argument("--opted-in-only", action="store_true")
+
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=["csv", "parquet"], help="defaults to the file extension")
+    import_parser.add_argument("--chunk-size", type=int, default=DEFAULT_IMPORT_CHUNK_SIZE)
+    import_parser.add_argument("--workers", type=int, default=DEFAULT_IMPORT_WORKERS)
+    import_parser.add_argument("--offsets", help="defaults to <path>.offsets.json")
+    import_parser.add_argument("--restart", action="store_true", help="ignore a saved offset")
+    args = parser.parse_args()
+
+    configure_logging()
+    database = get_database()
+
+    if args.command == "export":
+        result = export_entries(database, args.path, args.format, args.page_size, args.opted_in_only)
+    else:
+        result = import_entries(database, args.path, args.format, args.chunk_size, args.workers, args.offsets,
+                                args.restart)
+    print(json.dumps(result))
@@ -1,7 +1,20 @@
+import logging
 from google.cloud import spanner
+from operator import attrgetter
+
+from .bulk_writer import write_rows
+from .pipeline import stream_rows
+
+logger = logging.getLogger(__name__)
 
 
 class UserFeedback:
+    __slots__ = ('id', 'feedback_type', 'creation_time', 'username', 'email', 'full_name', 'content',
+                 'user_ip', 'user_agent')
+
+    COLUMNS = ('id', 'feedback_type', 'creation_time', 'username', 'email', 'full_name', 'content',
+               'user_ip', 'user_agent')
+
     def __init__(self, id, feedback_type, creation_time, username, email, full_name, content, user_ip, user_agent):
         self.id = id
         self.feedback_type = feedback_type
@@ -31,107 +44,53 @@ class UserFeedback:
             "user_agent": self.user_agent
         }
 
+    def to_row(self):
+        return _user_feedback_row(self)
 
-def create_table(database):
-    # Check if the table already exists
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql(
-            "SELECT table_name FROM information_schema.tables WHERE table_name = 'user_feedback'"
-        )
-        table_exists = any(row for row in results)
-
-    if table_exists:
-        print("Feedback table already exists. Skipping creation.")
-        return
-
-    # DDL statement to create the table
-    ddl_statements = [
-        """
-        CREATE TABLE user_feedback (
-            id STRING(50) NOT NULL,
-            feedback_type STRING(20) NOT NULL,
-            creation_time TIMESTAMP NOT NULL OPTIONS (allow_commit_timestamp = true),
-            username STRING(100) NOT NULL,
-            email STRING(1024) NOT NULL,
-            full_name STRING(1024) NOT NULL,
-            content STRING(8192) NOT NULL,
-            user_ip STRING(256) NOT NULL,
-            user_agent STRING(1024) NOT NULL
-        ) PRIMARY KEY (id)
-        """
-    ]
 
-    # Apply the DDL statement to create the table
-    operation = database.update_ddl(ddl_statements)
-    print("Waiting for operation to complete...")
-    operation.result()
-    print("Feedback table created successfully.")
+_user_feedback_row = attrgetter(*UserFeedback.COLUMNS)
 
 
 def insert_single_entry(database, feedback: UserFeedback):
     with database.batch() as batch:
         batch.insert(
             table='user_feedback',
-            columns=(
-                'id', 'feedback_type', 'creation_time', 'username', 'email', 'full_name',
-                'content', 'user_ip', 'user_agent'
-            ),
-            values=[
-                (
-                    feedback.id, feedback.feedback_type, feedback.creation_time, feedback.username,
-                    feedback.email, feedback.full_name, feedback.content, feedback.user_ip, feedback.user_agent
-                ),
-            ]
+            columns=UserFeedback.COLUMNS,
+            values=[feedback.to_row()]
         )
-    print("Single entry inserted successfully.")
-
-
-def insert_bulk_entries(database, feedback_list):
-    with database.batch() as batch:
-        batch.insert(
-            table='user_feedback',
-            columns=(
-                'id', 'feedback_type', 'creation_time', 'username', 'email', 'full_name',
-                'content', 'user_ip', 'user_agent'
-            ),
-            values=[
-                (
-                    feedback.id, feedback.feedback_type, feedback.creation_time, feedback.username,
-                    feedback.email, feedback.full_name, feedback.content, feedback.user_ip, feedback.user_agent
-                )
-                for feedback in feedback_list
-            ]
+    logger.info("Single entry inserted successfully.")
+
+
+def insert_bulk_entries(database, feedback_list, mode='insert'):
+    stats = write_rows(database, 'user_feedback', UserFeedback.COLUMNS,
+                       (feedback.to_row() for feedback in feedback_list), mode=mode)
+    logger.info("Bulk entries inserted successfully: %s", stats)
+    return stats
+
+
+def read_all_entries(database, workers=None):
+    feedback_list = []
+    for row in stream_rows(database, "SELECT * FROM user_feedback", workers=workers):
+        feedback = UserFeedback(
+            id=row[0],
+            feedback_type=row[1],
+            creation_time=row[2],
+            username=row[3],
+            email=row[4],
+            full_name=row[5],
+            content=row[6],
+            user_ip=row[7],
+            user_agent=row[8]
         )
-    print("Bulk entries inserted successfully.")
-
-
-def read_all_entries(database):
-    with database.snapshot() as snapshot:
-        results = snapshot.execute_sql("SELECT * FROM user_feedback")
-        feedback_list = []
-        for row in results:
-            feedback = UserFeedback(
-                id=row[0],
-                feedback_type=row[1],
-                creation_time=row[2],
-                username=row[3],
-                email=row[4],
-                full_name=row[5],
-                content=row[6],
-                user_ip=row[7],
-                user_agent=row[8]
-            )
-            feedback_list.append(feedback)
-            print(feedback)
-
-        return feedback_list
+        feedback_list.append(feedback)
+
+    return feedback_list
 
 
 # Function to populate the database with test entries
 
 
 def populate_test_entries(database):
-    create_table(database)
     bulk_feedback = [
         UserFeedback(
             id='1', feedback_type='bug', creation_time='2024-08-01T12:34:56Z', username='user1',
@@ -151,5 +110,6 @@ def populate_test_entries(database):
         # Add more entries as needed
     ]
 
-    insert_bulk_entries(database, bulk_feedback)
-    print("Database populated with test entries successfully.")
+    # Upserted, so populating twice is harmless
+    insert_bulk_entries(database, bulk_feedback, mode='insert_or_update')
+    logger.info("Database populated with test entries successfully.")
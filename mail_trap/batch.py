@@ -0,0 +1,93 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from email_marketing.pipeline import chunked
+from .sender import DEFAULT_MAX_RETRIES, SendReport, SendResult, backoff_delay, is_retryable
+
+
+MAX_BATCH_SIZE = 500  # messages per request accepted by the batch API
+DEFAULT_MAX_IN_FLIGHT = 2
+
+
+# One batch request holds a message per recipient, each with its own variables,
+# so recipients never see each other and personalization is kept.
+
+
+def build_batch_payload(sender, template_uuid, items, template_variables):
+    return {
+        "base": {
+            "from": sender,
+            "template_uuid": template_uuid,
+        },
+        "requests": [
+            {
+                "to": [{"email": item.email}],
+                "template_variables": template_variables(item),
+            }
+            for item in items
+        ],
+    }
+
+
+def post_batch_with_retry(send_fn, payload, max_retries=DEFAULT_MAX_RETRIES):
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return send_fn(payload), attempt
+        except Exception as e:
+            if attempt <= max_retries and is_retryable(e):
+                time.sleep(backoff_delay(attempt))
+                continue
+            raise
+
+
+def collect_batch_results(report, on_result, items, future, started):
+    def add(item, result):
+        report.add(result)
+        if on_result is not None:
+            on_result(item, result)
+
+    try:
+        response, attempts = future.result()
+    except Exception as e:
+        for item in items:
+            add(item, SendResult(item.email, False, status=getattr(e, "status", None), attempts=1,
+                                 error=str(e), latency=time.monotonic() - started))
+        return
+
+    latency = time.monotonic() - started
+    responses = response.get("responses", [])
+    for index, item in enumerate(items):
+        item_response = responses[index] if index < len(responses) else {"success": False, "errors": ["missing"]}
+        success = bool(item_response.get("success"))
+        add(item, SendResult(item.email, success, status=200, attempts=attempts,
+                             error=None if success else str(item_response.get("errors")),
+                             latency=latency, message_ids=item_response.get("message_ids")))
+
+
+# Builds the next batch while earlier ones are still in flight; at most
+# max_in_flight requests are outstanding at any time.
+
+
+def send_batches(items, sender, template_uuid, template_variables, send_fn,
+                 batch_size=MAX_BATCH_SIZE, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 max_retries=DEFAULT_MAX_RETRIES, on_result=None):
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    report = SendReport(mode="batch")
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for chunk in chunked(items, batch_size):
+            payload = build_batch_payload(sender, template_uuid, chunk, template_variables)
+            if len(pending) >= max_in_flight:
+                collect_batch_results(report, on_result, *pending.popleft())
+            future = executor.submit(post_batch_with_retry, send_fn, payload, max_retries)
+            pending.append((chunk, future, time.monotonic()))
+
+        while pending:
+            collect_batch_results(report, on_result, *pending.popleft())
+
+    report.finish()
+    return report
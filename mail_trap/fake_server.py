@@ -0,0 +1,114 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the Mailtrap sending API (/api/send and /api/batch) with
+# injectable latency, server errors and 429s, for offline runs and benchmarks.
+#
+#   python -m mail_trap.fake_server --port 8025 --latency 0.05 --rate-limit-rate 0.01
+#   MAILTRAP_BASE_URL=http://localhost:8025 python -m mail_trap.main
+
+
+class FakeMailtrapOptions:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.messages = 0
+
+    def roll(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.random(), self.random.uniform(-self.jitter, self.jitter)
+
+
+class FakeMailtrapHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients can reuse pooled connections
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; avoid Nagle + delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        options = self.server.options
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._respond(400, {"success": False, "errors": ["invalid JSON"]})
+            return
+
+        roll, jitter = options.roll()
+        time.sleep(max(0.0, options.latency + jitter))
+
+        if roll < options.rate_limit_rate:
+            self._respond(429, {"success": False, "errors": ["Too many requests"]})
+        elif roll < options.rate_limit_rate + options.error_rate:
+            self._respond(500, {"success": False, "errors": ["Internal server error"]})
+        elif self.path == "/api/send":
+            with options.lock:
+                options.messages += 1
+            self._respond(200, {"success": True, "message_ids": [str(uuid.uuid4())]})
+        elif self.path == "/api/batch":
+            requests = payload.get("requests", [])
+            with options.lock:
+                options.messages += len(requests)
+            self._respond(200, {
+                "success": True,
+                "responses": [{"success": True, "message_ids": [str(uuid.uuid4())]} for _ in requests]
+            })
+        else:
+            self._respond(404, {"success": False, "errors": ["Not found"]})
+
+
+def start_fake_server(host="127.0.0.1", port=0, options=None):
+    server = ThreadingHTTPServer((host, port), FakeMailtrapHandler)
+    server.daemon_threads = True
+    server.options = options or FakeMailtrapOptions()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def server_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a local fake Mailtrap sending API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds around the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server = start_fake_server(args.host, args.port, FakeMailtrapOptions(
+        args.latency, args.jitter, args.error_rate, args.rate_limit_rate))
+    print(f"Fake Mailtrap listening on {server_url(server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
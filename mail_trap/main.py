@@ -1,63 +1,160 @@
-from typing import List
+import argparse
+import logging
+from typing import Callable, Iterable, Optional
 import mailtrap as mt
 import os
 from dotenv import load_dotenv
-from google.cloud import spanner
-from email_marketing.email_marketing import EmailMarketing
-
-from email_marketing.email_marketing import get_all_entries as get_all_email_marketing_entries
+from email_marketing.connection import get_database
+from email_marketing.email_marketing import DEFAULT_PAGE_SIZE, Recipient, iter_recipients
+from email_marketing.logging_config import configure_logging
+from email_marketing.migrations import migrate
+from email_marketing.segments import iter_segment_members, refresh_segment
+from .batch import MAX_BATCH_SIZE, send_batches
+from .send_log import SendLedger, get_sent_ids
+from .scheduler import parse_domain_policies, send_by_domain
+from .sender import DEFAULT_CONCURRENCY, DEFAULT_RATE, SendReport, send_concurrently
+from .suppression import DEFAULT_INDEX_PATH, SuppressionFilter, SuppressionRecorder, load_suppression_index
+from .transport import HttpTransport, get_transport
 load_dotenv()
 
-# Set the Spanner emulator host and disable credentials
-os.environ["SPANNER_EMULATOR_HOST"] = os.getenv("SPANNER_EMULATOR_HOST")
-os.environ["GOOGLE_CLOUD_PROJECT"] = os.getenv("GOOGLE_CLOUD_PROJECT")
-os.environ["SPANNER_EMULATOR_CREDENTIALS"] = os.getenv(
-    "SPANNER_EMULATOR_CREDENTIALS")
-
-# Initialize the Spanner client
-spanner_client = spanner.Client()
-
-# Define the instance and database
-instance_id = 'test-instance'
-database_id = 'test-database'
-instance = spanner_client.instance(instance_id)
-database = instance.database(database_id)
-
-
-def transactional_stream(email_list: List[EmailMarketing]):
-
-    client = mt.MailtrapClient(token=os.getenv("MAILTRAP_API_TOKEN"))
-
-    for item in email_list:
-        mail = mt.MailFromTemplate(
-            sender=mt.Address(email="craigco@innosearch.ai",
-                              name="Mailtrap Test"),
-            to=[mt.Address(email=item.email)],
-            template_uuid="7755f2f7-b76c-47b8-b71a-55316fd6c54a",
-            template_variables={"name": item.first_name},
-        )
-
-        response = client.send(mail)
-        if response["success"]:
-            print(f"Email sent to {item.email}")
-        else:
-            print(f"Failed to send email to {item.email}")
-
-
-def bulk_stream(email_list: List[EmailMarketing]):
-    # create mail object
-    mail = mt.MailFromTemplate(
-        sender=mt.Address(email="craigco@innosearch.ai", name="Mailtrap Test"),
-        to=[mt.Address(email=item.email) for item in email_list],
-        template_uuid="7755f2f7-b76c-47b8-b71a-55316fd6c54a",
-        # template_variables={},
+logger = logging.getLogger(__name__)
+
+
+SENDER = mt.Address(email="craigco@innosearch.ai", name="Mailtrap Test")
+TEMPLATE_UUID = "7755f2f7-b76c-47b8-b71a-55316fd6c54a"
+
+
+def build_transactional_mail(item: Recipient):
+    return mt.MailFromTemplate(
+        sender=SENDER,
+        to=[mt.Address(email=item.email)],
+        template_uuid=TEMPLATE_UUID,
+        template_variables={"name": item.first_name},
     )
 
-    # create client and send
-    client = mt.MailtrapClient(token=os.getenv("MAILTRAP_API_TOKEN"))
-    client.send(mail)
+
+def log_failures(report: SendReport):
+    # Only a sample of the failures is kept; the ledger has every outcome
+    for result in report.failures:
+        logger.warning("Failed to send email to %s: %s", result.email, result.error)
+    if report.failed > len(report.failures):
+        logger.warning("%d more failed sends not listed.", report.failed - len(report.failures))
+
+
+def transactional_stream(email_list: Iterable[Recipient], concurrency: int = DEFAULT_CONCURRENCY,
+                         rate: float = DEFAULT_RATE, ledger: Optional[SendLedger] = None,
+                         transport: Optional[HttpTransport] = None, by_domain: bool = False,
+                         domain_limits: Optional[str] = None,
+                         suppressions: Optional[SuppressionRecorder] = None,
+                         on_result: Optional[Callable] = None) -> SendReport:
+
+    transport = transport or get_transport()
+
+    def record_result(item, result):
+        if ledger:
+            ledger.record(item, result)
+        if suppressions:
+            # Rejected recipients are suppressed for future runs
+            suppressions.record(item, result)
+        if on_result:
+            on_result(item, result)
+
+    handle_result = record_result if ledger or suppressions or on_result else None
+
+    if by_domain:
+        # Queued per recipient domain, each under its own limits (MAILTRAP_DOMAIN_LIMITS)
+        policies, default_policy = parse_domain_policies(domain_limits or os.getenv("MAILTRAP_DOMAIN_LIMITS"))
+        report = send_by_domain(
+            email_list, build_transactional_mail, transport.send, policies=policies,
+            default_policy=default_policy, concurrency=concurrency, rate=rate, on_result=handle_result)
+    else:
+        report = send_concurrently(
+            email_list, build_transactional_mail, transport.send, concurrency=concurrency, rate=rate,
+            on_result=handle_result)
+    if ledger:
+        ledger.flush()
+    if suppressions:
+        suppressions.flush()
+
+    log_failures(report)
+    logger.info("Transactional send finished: %s", report.summary())
+    if by_domain:
+        for domain, summary in report.domain_summary().items():
+            logger.info("Domain %s: %s", domain, summary)
+    return report
+
+
+def bulk_stream(email_list: Iterable[Recipient], batch_size: int = MAX_BATCH_SIZE,
+                ledger: Optional[SendLedger] = None, transport: Optional[HttpTransport] = None,
+                on_result: Optional[Callable] = None) -> SendReport:
+    transport = transport or get_transport()
+
+    def record_result(item, result):
+        if ledger:
+            ledger.record(item, result)
+        if on_result:
+            on_result(item, result)
+
+    # One personalized message per recipient, grouped into batch API requests
+    report = send_batches(
+        email_list,
+        sender={"email": SENDER.email, "name": SENDER.name},
+        template_uuid=TEMPLATE_UUID,
+        template_variables=lambda item: {"name": item.first_name},
+        send_fn=transport.send_batch,
+        batch_size=batch_size,
+        on_result=record_result if ledger or on_result else None,
+    )
+    if ledger:
+        ledger.flush()
+
+    log_failures(report)
+    logger.info("Bulk send finished: %s", report.summary())
+    return report
 
 
 if __name__ == '__main__':
-    emails = get_all_email_marketing_entries(database)
-    transactional_stream(emails)
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Send the marketing template to every email_marketing entry.")
+    parser.add_argument("--campaign", default=os.getenv("MAILTRAP_CAMPAIGN_ID", TEMPLATE_UUID),
+                        help="campaign id the sends are recorded under (defaults to the template uuid)")
+    parser.add_argument("--resume", action="store_true",
+                        help="skip recipients the send log already has for this campaign")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help="recipients fetched per keyset page")
+    parser.add_argument("--segment", help="send to the members of this segment instead of every opted-in entry")
+    parser.add_argument("--suppression-index", default=os.getenv("MAILTRAP_SUPPRESSION_INDEX", DEFAULT_INDEX_PATH),
+                        help="local snapshot file of the suppression list")
+    parser.add_argument("--rebuild-suppressions", action="store_true",
+                        help="reload the whole suppression list instead of only the new entries")
+    parser.add_argument("--by-domain", action="store_true",
+                        help="queue recipients per domain, each under its own rate and concurrency limit")
+    args = parser.parse_args()
+
+    database = get_database()
+    migrate(database)
+    suppression_index = load_suppression_index(database, args.suppression_index, args.rebuild_suppressions)
+    if args.segment:
+        # Catch the cached members up with email_marketing, then read them in one go
+        refresh_segment(database, args.segment)
+        emails = iter_segment_members(database, args.segment)
+    else:
+        # Only opted-in recipients, streamed page by page while sending
+        emails = iter_recipients(database, page_size=args.page_size)
+    if args.resume:
+        sent_ids = get_sent_ids(database, args.campaign)
+        logger.info("Resuming campaign %s: skipping %d recipients already sent.", args.campaign, len(sent_ids))
+        emails = (item for item in emails if item.id not in sent_ids)
+
+    with SendLedger(database, args.campaign) as ledger, SuppressionRecorder(database) as suppressions:
+        # Suppressed and malformed addresses never reach the sender
+        suppression_filter = SuppressionFilter(suppression_index, suppressions)
+        transactional_stream(
+            suppression_filter(emails),
+            concurrency=int(os.getenv("MAILTRAP_CONCURRENCY", DEFAULT_CONCURRENCY)),
+            rate=float(os.getenv("MAILTRAP_RATE_LIMIT", DEFAULT_RATE)),
+            ledger=ledger,
+            by_domain=args.by_domain,
+            suppressions=suppressions)
+    logger.info("Recipients filtered: %s", suppression_filter.summary())
+    suppression_index.close()
@@ -0,0 +1,232 @@
+import json
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .sender import (DEFAULT_BASE_DELAY, DEFAULT_CONCURRENCY, DEFAULT_MAX_RETRIES, DEFAULT_RATE, SendReport,
+                     TokenBucket, send_with_retry)
+
+
+# Per-recipient-domain scheduling in front of the sender. Recipients are read
+# ahead into one queue per receiving domain, and the queues are served round
+# robin, each under its own rate and concurrency limit, so a list dominated by
+# one big provider neither bursts into it nor holds everyone else back. The
+# Mailtrap plan's overall rate still applies on top. Read-ahead is bounded by
+# max_buffered; a larger buffer interleaves lopsided lists better.
+
+DomainPolicy = namedtuple('DomainPolicy', ['rate', 'concurrency'])
+
+# Receiving limits for the big providers; every other domain gets its own
+# queue under DEFAULT_DOMAIN_POLICY
+DEFAULT_DOMAIN_POLICIES = {
+    'gmail.com': DomainPolicy(rate=5, concurrency=4),
+    'googlemail.com': DomainPolicy(rate=2, concurrency=2),
+    'outlook.com': DomainPolicy(rate=3, concurrency=2),
+    'hotmail.com': DomainPolicy(rate=3, concurrency=2),
+    'live.com': DomainPolicy(rate=2, concurrency=2),
+    'yahoo.com': DomainPolicy(rate=3, concurrency=2),
+    'icloud.com': DomainPolicy(rate=2, concurrency=2),
+}
+DEFAULT_DOMAIN_POLICY = DomainPolicy(rate=2, concurrency=2)
+DEFAULT_MAX_BUFFERED = 10000
+
+
+def email_domain(email):
+    return email.rsplit('@', 1)[-1].strip().lower()
+
+
+# MAILTRAP_DOMAIN_LIMITS='{"gmail.com": {"rate": 5, "concurrency": 4}, "*": {"rate": 1, "concurrency": 1}}'
+# overrides or extends the defaults; "*" replaces the policy for other domains
+
+
+def parse_domain_policies(spec):
+    policies = dict(DEFAULT_DOMAIN_POLICIES)
+    default_policy = DEFAULT_DOMAIN_POLICY
+    for domain, limits in (json.loads(spec) if spec else {}).items():
+        policy = DomainPolicy(rate=limits.get('rate'), concurrency=limits.get('concurrency', 1))
+        if domain == '*':
+            default_policy = policy
+        else:
+            policies[domain.lower()] = policy
+    return policies, default_policy
+
+
+class DomainStats:
+    def __init__(self, domain, policy):
+        self.domain = domain
+        self.policy = policy
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency = 0.0
+        self.max_in_flight = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def add(self, result):
+        if result.success:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self.retries += max(0, result.attempts - 1)
+        self.latency += result.latency
+        self.finished_at = time.monotonic()
+
+    def summary(self):
+        count = self.sent + self.failed
+        elapsed = (self.finished_at or time.monotonic()) - (self.started_at or time.monotonic())
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "avg_latency_ms": round(self.latency / count * 1000, 1) if count else 0.0,
+            "max_in_flight": self.max_in_flight,
+            "emails_per_second": round(self.sent / elapsed, 2) if elapsed > 0 else 0.0,
+            "rate_limit": self.policy.rate,
+            "concurrency_limit": self.policy.concurrency
+        }
+
+
+class DomainSendReport(SendReport):
+    def __init__(self, mode="transactional"):
+        super().__init__(mode)
+        self.domains = {}
+
+    def domain_summary(self):
+        # Busiest domains first
+        ordered = sorted(self.domains.values(), key=lambda stats: stats.sent + stats.failed, reverse=True)
+        return {stats.domain: stats.summary() for stats in ordered}
+
+
+class DomainQueue:
+    __slots__ = ('items', 'bucket', 'policy', 'in_flight', 'stats')
+
+    def __init__(self, domain, policy):
+        self.items = deque()
+        self.policy = policy
+        self.bucket = TokenBucket(policy.rate) if policy.rate else None
+        self.in_flight = 0
+        self.stats = DomainStats(domain, policy)
+
+
+class DomainScheduler:
+    def __init__(self, policies=None, default_policy=DEFAULT_DOMAIN_POLICY):
+        self.policies = DEFAULT_DOMAIN_POLICIES if policies is None else policies
+        self.default_policy = default_policy
+        self.queues = {}
+        # Domains with queued items, in round-robin order
+        self.active = deque()
+        self.buffered = 0
+
+    def queue(self, domain):
+        queue = self.queues.get(domain)
+        if queue is None:
+            queue = self.queues[domain] = DomainQueue(domain, self.policies.get(domain, self.default_policy))
+        return queue
+
+    def put(self, item):
+        domain = email_domain(item.email)
+        queue = self.queue(domain)
+        if not queue.items:
+            self.active.append(domain)
+        queue.items.append(item)
+        self.buffered += 1
+
+    # Next item whose domain has both a free slot and a token, taking domains in
+    # turn. Returns (item, queue, None), or (None, None, delay) where delay is
+    # how long until a token frees up, or None if only slots are missing.
+    def next_ready(self):
+        delay = None
+        for _ in range(len(self.active)):
+            domain = self.active.popleft()
+            queue = self.queues[domain]
+            if queue.in_flight >= queue.policy.concurrency:
+                self.active.append(domain)
+                continue
+            wait_for = queue.bucket.try_acquire() if queue.bucket is not None else 0
+            if wait_for:
+                self.active.append(domain)
+                delay = wait_for if delay is None else min(delay, wait_for)
+                continue
+
+            item = queue.items.popleft()
+            self.buffered -= 1
+            if queue.items:
+                self.active.append(domain)
+            queue.in_flight += 1
+            queue.stats.max_in_flight = max(queue.stats.max_in_flight, queue.in_flight)
+            if queue.stats.started_at is None:
+                queue.stats.started_at = time.monotonic()
+            return item, queue, None
+        return None, None, delay
+
+
+class RetryLimiter:
+    # The scheduler already spent the first attempt's tokens; retries wait for
+    # their own from the domain and the overall limit
+    def __init__(self, *buckets):
+        self.buckets = [bucket for bucket in buckets if bucket is not None]
+        self.first = True
+
+    def acquire(self):
+        if self.first:
+            self.first = False
+            return
+        for bucket in self.buckets:
+            bucket.acquire()
+
+
+def send_by_domain(items, build_mail, send_fn, policies=None, default_policy=DEFAULT_DOMAIN_POLICY,
+                   concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE, max_retries=DEFAULT_MAX_RETRIES,
+                   base_delay=DEFAULT_BASE_DELAY, max_buffered=DEFAULT_MAX_BUFFERED, on_result=None):
+    scheduler = DomainScheduler(policies, default_policy)
+    rate_limiter = TokenBucket(rate) if rate else None
+    report = DomainSendReport()
+    items = iter(items)
+    exhausted = False
+
+    def send_item(item, queue):
+        limiter = RetryLimiter(queue.bucket, rate_limiter)
+        return item, queue, send_with_retry(send_fn, item.email, build_mail(item), limiter, max_retries, base_delay)
+
+    def collect(future):
+        item, queue, result = future.result()
+        queue.in_flight -= 1
+        report.add(result)
+        queue.stats.add(result)
+        if on_result is not None:
+            on_result(item, result)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+        while True:
+            while not exhausted and scheduler.buffered < max_buffered:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    scheduler.put(item)
+
+            delay = None
+            while len(in_flight) < concurrency:
+                item, queue, delay = scheduler.next_ready()
+                if item is None:
+                    break
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+                in_flight.add(executor.submit(send_item, item, queue))
+
+            if not in_flight:
+                if exhausted and not scheduler.buffered:
+                    break
+                # Every queued domain is waiting for a token
+                time.sleep(delay or 0.01)
+                continue
+
+            done, in_flight = wait(in_flight, timeout=delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future)
+
+    report.domains = {domain: queue.stats for domain, queue in scheduler.queues.items()}
+    report.finish()
+    return report
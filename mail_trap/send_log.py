@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+
+from google.cloud import spanner
+
+logger = logging.getLogger(__name__)
+
+
+# Ledger of completed sends per campaign, used to resume an interrupted run
+# without emailing anyone twice. A 'sent' entry is never replaced by a later
+# 'failed' one, e.g. from a rerun without --resume.
+
+LEDGER_COLUMNS = ('campaign_id', 'email_marketing_id', 'email', 'status', 'error', 'sent_at')
+DEFAULT_FLUSH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 5  # seconds
+
+
+# A single key-range read over the campaign's prefix of the primary key
+
+
+def get_sent_ids(database, campaign_id):
+    with database.snapshot() as snapshot:
+        results = snapshot.read(
+            table='send_log',
+            columns=('email_marketing_id', 'status'),
+            keyset=spanner.KeySet(ranges=[
+                spanner.KeyRange(start_closed=[campaign_id], end_closed=[campaign_id])
+            ])
+        )
+        return {row[0] for row in results if row[1] == 'sent'}
+
+
+def write_entries(transaction, entries):
+    # Failures are checked against the ledger in the same transaction, so one
+    # never overwrites a recipient already recorded as sent
+    failed_keys = [[entry[0], entry[1]] for entry in entries if entry[3] == 'failed']
+    sent = set()
+    if failed_keys:
+        results = transaction.read(table='send_log', columns=('campaign_id', 'email_marketing_id', 'status'),
+                                   keyset=spanner.KeySet(keys=failed_keys))
+        sent = {(row[0], row[1]) for row in results if row[2] == 'sent'}
+    values = [entry for entry in entries if entry[3] == 'sent' or (entry[0], entry[1]) not in sent]
+    if values:
+        transaction.insert_or_update(table='send_log', columns=LEDGER_COLUMNS, values=values)
+    if len(values) < len(entries):
+        logger.info("Kept %d 'sent' ledger entries over new failures.", len(entries) - len(values))
+    return len(values)
+
+
+class SendLedger:
+    def __init__(self, database, campaign_id, flush_size=DEFAULT_FLUSH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.database = database
+        self.campaign_id = campaign_id
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.recorded = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, item, result):
+        with self.lock:
+            self.buffer.append((
+                self.campaign_id, item.id, result.email,
+                'sent' if result.success else 'failed', result.error, spanner.COMMIT_TIMESTAMP
+            ))
+            if len(self.buffer) >= self.flush_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        self.recorded += self.database.run_in_transaction(write_entries, self.buffer)
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
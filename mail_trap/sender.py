@@ -0,0 +1,196 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from email_marketing.metrics import SEND_RETRIES, SEND_SECONDS, SENDS
+
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_RATE = 10  # emails per second allowed by the Mailtrap plan
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 0.5
+MAX_BACKOFF_DELAY = 30
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Failed results a report keeps for logging; every outcome goes to on_result
+DEFAULT_MAX_FAILURES = 100
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            # Seconds until the next token is available
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            time.sleep(delay)
+
+
+class SendResult:
+    def __init__(self, email, success, status=None, attempts=0, error=None, latency=0.0, message_ids=None):
+        self.email = email
+        self.success = success
+        self.status = status
+        self.attempts = attempts
+        self.error = error
+        self.latency = latency
+        self.message_ids = message_ids or []
+
+    def __repr__(self):
+        return (f"SendResult(email={self.email}, success={self.success}, status={self.status}, "
+                f"attempts={self.attempts}, error={self.error}, latency={self.latency:.3f})")
+
+    def to_dict(self):
+        return {
+            "email": self.email,
+            "success": self.success,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "latency": self.latency,
+            "message_ids": self.message_ids
+        }
+
+
+class SendReport:
+    # Counts outcomes and keeps the first max_failures failed results, so a
+    # run's memory does not grow with the number of recipients
+    def __init__(self, mode="transactional", max_failures=DEFAULT_MAX_FAILURES):
+        self.mode = mode
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.max_failures = max_failures
+        self.failures = []
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    def add(self, result):
+        if result.success:
+            self.sent += 1
+        else:
+            self.failed += 1
+            if len(self.failures) < self.max_failures:
+                self.failures.append(result)
+        self.retries += max(0, result.attempts - 1)
+        SEND_SECONDS.labels(mode=self.mode).observe(result.latency)
+        SENDS.labels(mode=self.mode, outcome="sent" if result.success else "failed").inc()
+        if result.attempts > 1:
+            SEND_RETRIES.labels(mode=self.mode).inc(result.attempts - 1)
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def emails_per_second(self):
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "emails_per_second": round(self.emails_per_second, 2)
+        }
+
+
+def error_status(exc):
+    # TransportError and mailtrap.exceptions.APIError carry the HTTP status of the failed response
+    return getattr(exc, "status", None)
+
+
+def is_retryable(exc):
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return error_status(exc) in RETRYABLE_STATUSES
+
+
+def backoff_delay(attempt, base_delay=DEFAULT_BASE_DELAY):
+    # Exponential backoff with jitter so retries from all workers do not line up
+    delay = min(MAX_BACKOFF_DELAY, base_delay * (2 ** (attempt - 1)))
+    return delay * random.uniform(0.5, 1.5)
+
+
+def send_with_retry(send_fn, email, mail, rate_limiter=None, max_retries=DEFAULT_MAX_RETRIES,
+                    base_delay=DEFAULT_BASE_DELAY):
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            response = send_fn(mail)
+        except Exception as e:
+            if attempt <= max_retries and is_retryable(e):
+                time.sleep(backoff_delay(attempt, base_delay))
+                continue
+            return SendResult(email, False, status=error_status(e), attempts=attempt, error=str(e),
+                              latency=time.monotonic() - started)
+
+        success = bool(response.get("success"))
+        return SendResult(email, success, status=200, attempts=attempt,
+                          error=None if success else str(response.get("errors")),
+                          latency=time.monotonic() - started, message_ids=response.get("message_ids"))
+
+
+# Sends one message per item on a thread pool. Items are consumed lazily and at
+# most twice the concurrency is in flight, so any iterable of recipients works.
+
+
+def send_concurrently(items, build_mail, send_fn, concurrency=DEFAULT_CONCURRENCY, rate=DEFAULT_RATE,
+                      max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, on_result=None):
+    rate_limiter = TokenBucket(rate) if rate else None
+    report = SendReport()
+
+    def send_item(item):
+        return item, send_with_retry(send_fn, item.email, build_mail(item), rate_limiter, max_retries, base_delay)
+
+    def collect(future):
+        item, result = future.result()
+        report.add(result)
+        if on_result is not None:
+            on_result(item, result)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+        for item in items:
+            if len(in_flight) >= concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            in_flight.add(executor.submit(send_item, item))
+
+        for future in in_flight:
+            collect(future)
+
+    report.finish()
+    return report
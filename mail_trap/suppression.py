@@ -0,0 +1,245 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+
+from google.cloud import spanner
+
+from email_marketing.connection import get_database
+from email_marketing.email_marketing import normalize_email
+from email_marketing.fingerprint_index import FingerprintIndex, fingerprint
+from email_marketing.logging_config import configure_logging
+from email_marketing.migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+
+# Addresses the sender must skip: hard rejections fed back from send results,
+# malformed addresses and manual suppressions, keyed by normalized email. Each
+# run loads them once into a FingerprintIndex snapshot (a sorted, mmap'd array
+# of 64-bit email hashes) and filters recipients through it on their way to
+# the sender, checking email syntax in the same pass. The snapshot file is
+# kept between runs and caught up with the rows suppressed since, so only new
+# suppressions are read; removing a suppression takes effect on the next
+# rebuild (--rebuild-suppressions).
+#
+#   python -m mail_trap.suppression add jane@example.com --reason complaint
+#   python -m mail_trap.suppression list
+
+DEFAULT_INDEX_PATH = 'suppression.idx'
+DEFAULT_FLUSH_SIZE = 500
+
+# Responses that reject the recipient itself; 429, 5xx and transport errors
+# are transient and never suppress
+REJECTED_STATUSES = {400, 422}
+
+SUPPRESSION_COLUMNS = ('email_normalized', 'email', 'reason', 'detail', 'suppressed_at')
+
+# RFC 5321 limits, in octets, and a conservative dot-atom local part
+MAX_EMAIL_LENGTH = 254
+MAX_LOCAL_LENGTH = 64
+LOCAL_PART = re.compile(r"^[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*$")
+DOMAIN_LABEL = re.compile(r"^[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?$")
+
+
+def is_malformed(email):
+    # Addresses no mail server can accept: no local part or domain, or over the length limits
+    if not email or len(email.encode('utf-8')) > MAX_EMAIL_LENGTH:
+        return True
+    local, at, domain = email.rpartition('@')
+    return not at or not local or not domain or len(local.encode('utf-8')) > MAX_LOCAL_LENGTH
+
+
+def is_valid_email(email):
+    # ASCII dot-atom addresses only; IDN domains and quoted local parts are
+    # real addresses this check does not cover
+    if is_malformed(email):
+        return False
+    local, _, domain = email.rpartition('@')
+    if not LOCAL_PART.match(local):
+        return False
+    labels = domain.split('.')
+    # At least one dot, and a top-level domain that is not all digits
+    return len(labels) > 1 and all(DOMAIN_LABEL.match(label) for label in labels) and not labels[-1].isdigit()
+
+
+def suppress(database, entries):
+    # entries are (email, reason, detail); a later suppression replaces the reason
+    with database.batch() as batch:
+        batch.insert_or_update(
+            table='suppression',
+            columns=SUPPRESSION_COLUMNS,
+            values=[(normalize_email(email), email.strip(), reason, detail, spanner.COMMIT_TIMESTAMP)
+                    for email, reason, detail in entries]
+        )
+
+
+def unsuppress(database, emails):
+    with database.batch() as batch:
+        batch.delete(table='suppression', keyset=spanner.KeySet(keys=[[normalize_email(email)] for email in emails]))
+
+
+def read_suppressions(database, since=None):
+    # Yields (email_normalized, suppressed_at), only those after since if given
+    with database.snapshot() as snapshot:
+        if since is None:
+            results = snapshot.read(table='suppression', columns=('email_normalized', 'suppressed_at'),
+                                    keyset=spanner.KeySet(all_=True))
+        else:
+            results = snapshot.execute_sql(
+                "SELECT email_normalized, suppressed_at FROM suppression WHERE suppressed_at > @since",
+                params={"since": since}, param_types={"since": spanner.param_types.TIMESTAMP})
+        for row in results:
+            yield row[0], row[1]
+
+
+def load_suppression_index(database, path=DEFAULT_INDEX_PATH, rebuild=False):
+    # <path>.state holds the latest suppressed_at the snapshot includes
+    state_path = path + '.state'
+    since = None
+    if not rebuild and os.path.exists(path) and os.path.exists(state_path):
+        with open(state_path) as f:
+            since = datetime.fromisoformat(json.load(f)["since"])
+
+    latest = since
+    fingerprints = []
+    for email_normalized, suppressed_at in read_suppressions(database, since):
+        fingerprints.append(fingerprint(email_normalized))
+        latest = suppressed_at if latest is None else max(latest, suppressed_at)
+
+    if since is None:
+        index = FingerprintIndex.build(path, fingerprints)
+    else:
+        index = FingerprintIndex(path)
+        index.add(fingerprints)
+        index.compact()
+
+    if latest is not None:
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"since": latest.isoformat()}, f)
+        os.replace(tmp_path, state_path)
+    logger.info("Suppression index loaded: %d addresses (%d new).", len(index), len(fingerprints))
+    return index
+
+
+class SuppressionFilter:
+    # Drops suppressed and syntactically invalid recipients from a stream.
+    # Only malformed ones are handed to the recorder and suppressed for good;
+    # addresses outside the dot-atom check (IDN domains, quoted local parts)
+    # are skipped for this run and checked again on the next one.
+    def __init__(self, index, recorder=None):
+        self.index = index
+        self.recorder = recorder
+        self.passed = 0
+        self.suppressed = 0
+        self.invalid = 0
+        self.skipped = 0
+
+    def __call__(self, items):
+        for item in items:
+            email = item.email.strip() if item.email else item.email
+            if is_malformed(email):
+                self.invalid += 1
+                if self.recorder is not None and email:
+                    self.recorder.add(email, 'invalid', None)
+                continue
+            if not is_valid_email(email):
+                self.skipped += 1
+                logger.debug("Skipping %s: not a dot-atom address.", email)
+                continue
+            if fingerprint(normalize_email(email)) in self.index:
+                self.suppressed += 1
+                continue
+            self.passed += 1
+            yield item
+
+    def summary(self):
+        return {"passed": self.passed, "suppressed": self.suppressed, "invalid": self.invalid,
+                "skipped": self.skipped}
+
+
+class SuppressionRecorder:
+    # Collects recipients the API rejected and writes them to the suppression
+    # table in batches, like SendLedger, along with the invalid addresses the
+    # filter found. Until a send has succeeded, rejections are held back: every
+    # send failing points at the request, not the recipients.
+    def __init__(self, database, flush_size=DEFAULT_FLUSH_SIZE):
+        self.database = database
+        self.flush_size = flush_size
+        self.buffer = []
+        self.sent = 0
+        self.recorded = 0
+        self.lock = threading.Lock()
+
+    def add(self, email, reason, detail):
+        with self.lock:
+            self.buffer.append((email, reason, detail))
+            if len(self.buffer) >= self.flush_size and (self.sent or reason != 'rejected'):
+                self._flush()
+
+    def record(self, item, result):
+        if result.success:
+            with self.lock:
+                self.sent += 1
+        elif result.status in REJECTED_STATUSES or result.status == 200:
+            # A 200 without success is a per-message rejection
+            self.add(result.email, 'rejected', result.error)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        ready = self.buffer if self.sent else [entry for entry in self.buffer if entry[1] != 'rejected']
+        if not ready:
+            return
+        suppress(self.database, ready)
+        self.recorded += len(ready)
+        self.buffer = [] if self.sent else [entry for entry in self.buffer if entry[1] == 'rejected']
+
+    def close(self):
+        self.flush()
+        if self.buffer:
+            logger.warning("Not suppressing %d rejected recipients: no send succeeded in this run.",
+                           len(self.buffer))
+            self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage the suppression list.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add")
+    add_parser.add_argument("emails", nargs="+")
+    add_parser.add_argument("--reason", default="manual", help="e.g. manual, bounce, complaint")
+    add_parser.add_argument("--detail")
+
+    remove_parser = subparsers.add_parser("remove")
+    remove_parser.add_argument("emails", nargs="+")
+
+    subparsers.add_parser("list")
+    args = parser.parse_args()
+
+    configure_logging()
+    database = get_database()
+    migrate(database)
+
+    if args.command == "add":
+        suppress(database, [(email, args.reason, args.detail) for email in args.emails])
+    elif args.command == "remove":
+        unsuppress(database, args.emails)
+    else:
+        with database.snapshot() as snapshot:
+            for row in snapshot.read(table='suppression', columns=SUPPRESSION_COLUMNS,
+                                     keyset=spanner.KeySet(all_=True)):
+                print(json.dumps(dict(zip(SUPPRESSION_COLUMNS, row)), default=str))
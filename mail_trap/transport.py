@@ -0,0 +1,63 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# HTTP transport for the Mailtrap sending API. A single keep-alive session is
+# shared by every send so connections are reused across threads and calls.
+
+DEFAULT_BASE_URL = "https://send.api.mailtrap.io"
+DEFAULT_POOL_SIZE = 32
+REQUEST_TIMEOUT = 30
+
+
+class TransportError(Exception):
+    def __init__(self, status, errors):
+        super().__init__(f"Mailtrap request failed with status {status}: {errors}")
+        self.status = status
+        self.errors = errors
+
+
+class HttpTransport:
+    def __init__(self, token=None, base_url=None, pool_size=DEFAULT_POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        self.base_url = (base_url or os.getenv("MAILTRAP_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Retries are handled by the senders, which know about rate limits
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {token or os.getenv('MAILTRAP_API_TOKEN')}",
+            "Content-Type": "application/json",
+        })
+
+    def _post(self, path, payload):
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        if response.status_code != 200:
+            raise TransportError(response.status_code, response.text)
+        return response.json()
+
+    def send(self, mail):
+        # mailtrap.Mail / MailFromTemplate objects expose their request body as api_data
+        return self._post("/api/send", getattr(mail, "api_data", mail))
+
+    def send_batch(self, payload):
+        return self._post("/api/batch", payload)
+
+    def close(self):
+        self.session.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = HttpTransport()
+        return _default_transport
@@ -0,0 +1,46 @@
+import pytest
+
+from email_marketing.migrations import MIGRATIONS, DuplicateEmails, migrate
+
+
+class Snapshot:
+    def __init__(self, database):
+        self.database = database
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def execute_sql(self, sql, params=None, param_types=None):
+        if 'information_schema' in sql:
+            return list(self.database.existing)
+        if 'schema_version' in sql:
+            return [(version,) for version in self.database.applied]
+        return self.database.duplicates
+
+
+class Database:
+    # Schema of a database from before schema_version, with email_marketing but no email index
+    def __init__(self, duplicates):
+        self.existing = {('table', 'account'), ('table', 'user_feedback'), ('table', 'email_marketing')}
+        self.applied = set()
+        self.duplicates = duplicates
+        self.ddl = []
+
+    def snapshot(self, multi_use=False):
+        return Snapshot(self)
+
+    def update_ddl(self, statements):
+        self.ddl.append(statements)
+        raise AssertionError("DDL should not run")
+
+
+def test_unique_email_index_is_not_attempted_over_duplicates():
+    database = Database([('jane@example.com', 2)])
+
+    with pytest.raises(DuplicateEmails, match='--dedup-emails'):
+        migrate(database, [migration for migration in MIGRATIONS if migration.version == 4])
+
+    assert database.ddl == []
@@ -0,0 +1,52 @@
+from email_marketing.opt_in import bulk_update_opt_in_status
+
+
+class Snapshot:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def read(self, table, columns, keyset, index=None):
+        keys = [key[0] for key in keyset.keys]
+        if index is not None:
+            return [(email, id) for id, (email, _) in self.rows.items() if email in keys]
+        return [(id, self.rows[id][1]) for id in keys if id in self.rows]
+
+
+class Batch(Snapshot):
+    def update(self, table, columns, values):
+        for id, status, _ in values:
+            self.rows[id] = (self.rows[id][0], status)
+
+
+class Database:
+    # email_marketing rows as id -> (email_normalized, opt_in_status)
+    def __init__(self, rows):
+        self.rows = rows
+
+    def snapshot(self, multi_use=False):
+        return Snapshot(self.rows)
+
+    def batch(self):
+        return Batch(self.rows)
+
+
+def test_counts_add_up_when_a_chunk_repeats_an_entry():
+    database = Database({'1': ('a@example.com', True), '2': ('b@example.com', True)})
+    items = [
+        {"id": "1", "opt_in_status": "true"},
+        {"email": "A@example.com", "opt_in_status": "false"},
+        {"email": "b@example.com", "opt_in_status": "true"},
+        {"email": "nobody@example.com", "opt_in_status": "false"},
+        {"opt_in_status": "false"},
+    ]
+
+    stats = bulk_update_opt_in_status(database, items)
+
+    assert stats == {"received": 5, "applied": 1, "unchanged": 1, "unknown": 1, "invalid": 1, "superseded": 1}
+    assert database.rows['1'] == ('a@example.com', False)
@@ -0,0 +1,37 @@
+from email_marketing.email_marketing import Recipient
+from mail_trap.send_log import SendLedger
+from mail_trap.sender import SendResult
+
+
+class Transaction:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def read(self, table, columns, keyset):
+        return [key + [self.rows[tuple(key)][3]] for key in keyset.keys if tuple(key) in self.rows]
+
+    def insert_or_update(self, table, columns, values):
+        for value in values:
+            self.rows[value[:2]] = value
+
+
+class Database:
+    def __init__(self):
+        self.rows = {}
+
+    def run_in_transaction(self, fn, *args):
+        return fn(Transaction(self.rows), *args)
+
+
+def test_a_later_failure_does_not_overwrite_a_sent_entry():
+    database = Database()
+    jane = Recipient('1', 'jane@example.com', 'Jane')
+    john = Recipient('2', 'john@example.com', 'John')
+    with SendLedger(database, 'campaign') as ledger:
+        ledger.record(jane, SendResult(jane.email, True))
+    with SendLedger(database, 'campaign') as ledger:
+        ledger.record(jane, SendResult(jane.email, False, error='timeout'))
+        ledger.record(john, SendResult(john.email, False, error='timeout'))
+
+    assert database.rows[('campaign', '1')][3] == 'sent'
+    assert database.rows[('campaign', '2')][3] == 'failed'
@@ -0,0 +1,10 @@
+from mail_trap.sender import SendReport, SendResult
+
+
+def test_report_counts_every_result_but_keeps_a_capped_sample_of_failures():
+    report = SendReport(max_failures=2)
+    for i in range(5):
+        report.add(SendResult(f"user{i}@example.com", i == 0, attempts=2))
+
+    assert (report.sent, report.failed, report.retries) == (1, 4, 5)
+    assert [result.email for result in report.failures] == ['user1@example.com', 'user2@example.com']
@@ -0,0 +1,23 @@
+from email_marketing.email_marketing import Recipient
+from mail_trap.suppression import SuppressionFilter
+
+
+class Recorder:
+    def __init__(self):
+        self.entries = []
+
+    def add(self, email, reason, detail):
+        self.entries.append((email, reason, detail))
+
+
+def test_only_malformed_addresses_are_suppressed():
+    recorder = Recorder()
+    suppression_filter = SuppressionFilter(set(), recorder)
+    items = [Recipient(str(i), email, None) for i, email in enumerate(
+        ['jane@example.com', 'user@bücher.de', '"john doe"@example.com', 'no-at-sign', 'x' * 65 + '@example.com'])]
+
+    passed = [item.email for item in suppression_filter(items)]
+
+    assert passed == ['jane@example.com']
+    assert [entry[0] for entry in recorder.entries] == ['no-at-sign', 'x' * 65 + '@example.com']
+    assert suppression_filter.summary() == {"passed": 1, "suppressed": 0, "invalid": 2, "skipped": 2}
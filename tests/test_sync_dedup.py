@@ -0,0 +1,30 @@
+from email_marketing.account import Account
+from email_marketing.email_marketing import update_email_marketing
+from email_marketing.sqlite_repository import SqliteRepository
+
+
+def account(id, email):
+    return Account(id, email, 'password', 'pw', 'Test User', 'active', '{}', 'test', 'test', 1)
+
+
+def test_writer_flush_inside_a_chunk_does_not_reinsert_pending_emails():
+    # With chunk_size 3 the first chunk leaves a and b pending in the writer;
+    # adding c in the second chunk flushes them, and a' later in that chunk
+    # must still be recognised as a duplicate
+    repository = SqliteRepository()
+    repository.create_tables()
+    repository.insert_accounts([
+        account('1', 'a@example.com'),
+        account('2', 'b@example.com'),
+        account('3', ' B@example.com'),
+        account('4', 'c@example.com'),
+        account('5', 'A@Example.com '),
+        account('6', 'd@example.com'),
+        account('7', 'c@example.com'),
+    ])
+
+    result = update_email_marketing(repository, chunk_size=3)
+
+    assert result["sources"]["account"] == {"scanned": 7, "duplicates": 3, "added": 4}
+    assert sorted(repository.normalized_emails()) == ['a@example.com', 'b@example.com', 'c@example.com',
+                                                      'd@example.com']
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from email_marketing.email_marketing import update_email_marketing
+from email_marketing.sqlite_repository import SqliteRepository
+from email_marketing.user_feedback import UserFeedback
+
+
+def feedback(id, email, creation_time):
+    return UserFeedback(id, 'bug', creation_time, 'user', email, 'Test User', 'content', '127.0.0.1', 'test')
+
+
+def test_user_feedback_committed_after_a_sync_with_an_older_creation_time_is_synced():
+    repository = SqliteRepository()
+    repository.create_tables()
+    repository.insert_user_feedback([feedback('1', 'a@example.com', '2024-08-01T12:10:00Z')])
+    update_email_marketing(repository)
+
+    # Written before the first sync's watermark, but committed after it
+    repository.insert_user_feedback([feedback('2', 'b@example.com', '2024-08-01T12:05:00Z')])
+    result = update_email_marketing(repository)
+
+    assert result["sources"]["user_feedback"]["added"] == 1
+    assert sorted(repository.normalized_emails()) == ['a@example.com', 'b@example.com']
+    # The re-read window does not move the watermark back
+    assert repository.get_watermarks()['user_feedback'].isoformat() == '2024-08-01T12:10:00+00:00'
+
+
+def test_rows_older_than_the_lookback_window_wait_for_a_full_sync():
+    repository = SqliteRepository()
+    repository.create_tables()
+    repository.insert_user_feedback([feedback('1', 'a@example.com', '2024-08-01T12:10:00Z')])
+    update_email_marketing(repository)
+
+    repository.insert_user_feedback([feedback('2', 'b@example.com', '2024-08-01T11:00:00Z')])
+    assert update_email_marketing(repository, lookback=timedelta(minutes=15))["sources"]["user_feedback"]["added"] == 0
+    assert update_email_marketing(repository, full=True)["sources"]["user_feedback"]["added"] == 1
+
+
+def test_watermark_moves_past_rows_of_emails_already_synced():
+    repository = SqliteRepository()
+    repository.create_tables()
+    repository.insert_user_feedback([feedback('1', 'a@example.com', '2024-08-01T12:10:00Z')])
+    update_email_marketing(repository)
+
+    # Only a known email past the watermark: nothing to add, but the range is done
+    repository.insert_user_feedback([feedback('2', 'A@example.com', '2024-08-01T13:00:00Z')])
+    result = update_email_marketing(repository)
+
+    assert result["sources"]["user_feedback"]["added"] == 0
+    assert repository.get_watermarks()['user_feedback'].isoformat() == '2024-08-01T13:00:00+00:00'